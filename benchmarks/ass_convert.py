@@ -0,0 +1,87 @@
+"""Benchmark of the conversion of the ASS/SSA subtitles in srt.
+
+Generates an ASS file then measures the CPU time of `repeat` conversions
+and the memory of one conversion, by :py:func:`jellyfin2txt.ass.convert`
+and by pyasstosrt when it is installed.
+
+usage: python benchmarks/ass_convert.py [--events EVENTS] [--repeat REPEAT] [--overlap] [--seed SEED]
+"""
+import os
+import sys
+import random
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from time import process_time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jellyfin2txt import ass  # noqa: E402
+
+
+def ass_time(ms: int) -> str:
+    return f"{ms // 3600000}:{ms // 60000 % 60:02}:{ms // 1000 % 60:02}.{ms % 1000 // 10:02}"
+
+
+def generate(path: Path, events: int, overlap: bool, seed: int) -> None:
+    """Write an ASS file of `events` dialogues with override tags, overlapping when `overlap`."""
+    generator: random.Random = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(
+            '[Script Info]\nTitle: benchmark\n\n[V4+ Styles]\nFormat: Name, Fontname\nStyle: Default,Arial\n\n'
+            '[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n'
+        )
+        start: int = 0
+        for index in range(events):
+            start += generator.randint(50, 2000) if overlap else generator.randint(4100, 6000)
+            end: int = start + generator.randint(500, 4000)
+            file.write(
+                f"Dialogue: 0,{ass_time(start)},{ass_time(end)},Default,,0,0,0,,"
+                f"{{\\k20\\fad(100,100)\\pos(320,40)}}Line {index}{{\\k30}} karaoke\\Nsecond\n"
+            )
+
+
+def measure(name: str, function, repeat: int) -> None:
+    started: float = process_time()
+    for _ in range(repeat):
+        function()
+    cpu: float = process_time() - started
+    tracemalloc.start()
+    function()
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<12} cpu {cpu:6.2f} s  peak {peak / 1e6:6.1f} MB")
+
+
+def main() -> None:
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument('--events', type=int, default=20000, help='Number of dialogues, default 20000')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of conversions timed, default 10')
+    parser.add_argument('--overlap', action='store_true', help='Make most of the dialogues overlap')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated file, default 1')
+    args: Namespace = parser.parse_args()
+
+    folder: Path = Path(tempfile.mkdtemp())
+    source: Path = folder / 'benchmark.ass'
+    generate(source, args.events, args.overlap, args.seed)
+    print(f"{source.stat().st_size / 1e6:.1f} MB, {args.events} events")
+
+    def streaming() -> None:
+        with open(source, 'rb') as file, open(folder / 'streaming.srt', 'w', encoding='utf-8') as out:
+            ass.convert((line.decode('utf-8') for line in file), out)
+
+    measure('streaming', streaming, args.repeat)
+    try:
+        from pyasstosrt import Subtitle
+    except ImportError:
+        print('pyasstosrt not installed, skipped')
+    else:
+        measure('pyasstosrt', lambda: Subtitle(source).export(output_dir=folder), args.repeat)
+    for path in folder.iterdir():
+        os.remove(path)
+    folder.rmdir()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,66 @@
 #!/bin/python
 
+import os
 import sys
 import json
+import signal
+import subprocess
 from argparse import (
     ArgumentParser,
     Namespace,
 )
-from threading import Thread
+from pathlib import Path
+from threading import Thread, Event
+from typing import Optional
 
-from flask import request
+from flask import Response, request, stream_with_context
 
-from jellyfin2txt.key import KeysValidator
+from jellyfin2txt.key import Key, KeysValidator
 from jellyfin2txt.config import (
     client,
     app,
+    catalog_cache,
+    play_info_cache,
 )
 from jellyfin2txt.media import Media
+from jellyfin2txt.index import library_index, library_snapshot
+from jellyfin2txt.store import subtitle_store
+from jellyfin2txt.scheduler import extract_scheduler
+from jellyfin2txt.cleaner import subtitle_cleaner
+from jellyfin2txt.static import static_subtitles
 from jellyfin2txt.subtitle import Subtitle
 from jellyfin2txt.utils import _read_keyfile
+from jellyfin2txt import shared
+
+MOVIES_ID_ENV: str = 'JELLYFIN2TXT_MOVIES_ID'
+SERIES_ID_ENV: str = 'JELLYFIN2TXT_SERIES_ID'
+
+if shared.worker:
+    # The workers of the production server use the library folders found by main().
+    client.movies_id: str = os.environ[MOVIES_ID_ENV]
+    client.series_id: str = os.environ[SERIES_ID_ENV]
+
+def request_key(data: bytes) -> Optional[Key]:
+    """Return the valid and non-revoked authorization key of JSON data.
+
+    :param data: The input data containing a JSON-encoded string.
+
+    :returns:
+        The :py:class:`Key` of the "auth_key" field, or None if the key is
+        invalid, revoked or if the JSON parsing fails.
+    """
+    data_str: str = data.decode('utf-8')
+    try:
+        data_json: dict = json.loads(data_str)
+    except json.decoder.JSONDecodeError:
+        return None
+    if not isinstance(data_json, dict) or not isinstance(data_json.get('auth_key'), str):
+        return None
+    keys: KeysValidator = _read_keyfile()
+    key: Key = keys.get('key', data_json['auth_key'])
+    if key is None or key.revoked:
+        return None
+    return key
 
 def check_perms(data: bytes) -> bool:
     """Validate the authorization key in JSON data.
@@ -35,19 +78,13 @@ def check_perms(data: bytes) -> bool:
             - True: If the data contains a valid, non-revoked authorization key.
             - False:  If the data contains an invalid, revoked or if the JSON parsing fails.
     """
-    data_str: str = data.decode('utf-8')
-    try:
-        data_json: dict = json.loads(data_str)
-        if "auth_key" in data_json.keys():
-            keys: KeysValidator = _read_keyfile()
-            if keys.contains('key', data_json['auth_key']):
-                if not keys.get('key', data_json['auth_key']).revoked:
-                    return True
-                return False
-            return False
-        return False
-    except json.decoder.JSONDecodeError:
-        return False
+    return request_key(data) is not None
+
+def status_args() -> (Optional[int], float):
+    """Return the `since` and `wait` query parameters of the status endpoints."""
+    since: Optional[int] = request.args.get('since', type=int)
+    wait: float = request.args.get('wait', 0, type=float)
+    return since, max(0, min(wait, app.config.get('EXTRACT_STATUS_MAX_WAIT', 30)))
 
 def access_denied() -> (str, int):
     """Build HTTP access denied response.
@@ -219,6 +256,24 @@ def subtitle(item_id: str, subtitle_name: str) -> str:
         return Subtitle.subtitle(item_id, subtitle_name)
     return access_denied()
 
+@app.route('/files/<subtitle_file>')
+def subtitle_file(subtitle_file: str) -> Response:
+    """Serve a subtitle file when `SERVE_SUBTITLES` is enabled.
+
+    No authorization key is needed, like on the web server of `PROXY_URL`
+    the subtitle URLs point to. The file is served with a strong ETag and
+    compressed when the client accepts it, `If-None-Match` and `Range`
+    requests are supported.
+
+    :param subtitle_file: The file name of the subtitle.
+
+    :returns:
+        The subtitle file, or a 404 if the file or the endpoint do not exist.
+    """
+    if not app.config.get('SERVE_SUBTITLES', False):
+        return "Not found", 404
+    return static_subtitles.response(subtitle_file)
+
 @app.route('/subtitles/<item_id>/<subtitle_name>/extract', methods=['POST'])
 def subtitle_extract(item_id: str, subtitle_name: str) -> str:
     """Extract and cache subtitle from a media.
@@ -237,8 +292,9 @@ def subtitle_extract(item_id: str, subtitle_name: str) -> str:
         or if there was an issue (e.g., "Extraction job started" or "Failed to start
         extraction"), or an access denied message if the authorization fails.
     """
-    if check_perms(request.data):
-        return Subtitle.subtitle_extract(item_id, subtitle_name)
+    key: Optional[Key] = request_key(request.data)
+    if key is not None:
+        return Subtitle.subtitle_extract(item_id, subtitle_name, key.id)
     return access_denied()
 
 @app.route('/subtitles/<item_id>/discover', methods=['POST'])
@@ -246,17 +302,20 @@ def subtitle_discover(item_id: str) -> str:
     """Discover and cache the best subtitle available for a media.
 
     First checks if the request contains a valid and non-revoked authorization key.
-    If the authorization is successful, it starts the extraction process for the subtitles
-    of the media. If the authorization fails, it returns an access denied response.
-    The caching will be done in a separate thread.
+    If the authorization is successful, it starts the search of the subtitles of the
+    media on the providers. If the authorization fails, it returns an access denied
+    response. The search is done in the background, the id of the job is returned in
+    the `X-Job-Id` header.
 
     :param item_id: The unique identifier for the media.
 
     :returns:
-        The list of external subtitles available for this Jellyfin media.
+        The list of external subtitles available for this Jellyfin media once the
+        search is done, otherwise the status of the search.
     """
-    if check_perms(request.data):
-        return Subtitle.subtitle_discover(item_id)
+    key: Optional[Key] = request_key(request.data)
+    if key is not None:
+        return Subtitle.subtitle_discover(item_id, key.id)
     return access_denied()
 
 @app.route('/subtitles/<item_id>/all', methods=['POST'])
@@ -286,6 +345,11 @@ def subtitle_extract_status(item_id: str, subtitle_name: str) -> str:
     subtitle with the specified name for the media. If the authorization fails, it
     returns an access denied response.
 
+    QUERY PARAMETERS:
+        - since (:py:class:`int`, optional): The `X-Since` header of the previous response.
+        - wait (:py:class:`float`, optional): With `since`, the maximum time in seconds to wait
+        for a change before answering (default: 0, at most `EXTRACT_STATUS_MAX_WAIT`).
+
     :params item_id: The unique identifier for the media.
     :params subtitle_name: The name of the subtitle for the media.
 
@@ -293,7 +357,7 @@ def subtitle_extract_status(item_id: str, subtitle_name: str) -> str:
         The extraction status in a Resonite compatible format.
     """
     if check_perms(request.data):
-        return Subtitle.subtitle_extract_status(item_id, subtitle_name)
+        return Subtitle.subtitle_extract_status(item_id, subtitle_name, *status_args())
     return access_denied()
 
 @app.route('/extract_status', methods=['POST'])
@@ -304,13 +368,172 @@ def extract_status() -> str:
     If the authorization is successful, it returns the extraction status for all
     cached subtitles. If the authorization fails, it returns an access denied response.
 
+    QUERY PARAMETERS:
+        - since (:py:class:`int`, optional): The `X-Since` header of the previous response, only the
+        status changed since are returned.
+        - wait (:py:class:`float`, optional): With `since`, the maximum time in seconds to wait
+        for a change before answering (default: 0, at most `EXTRACT_STATUS_MAX_WAIT`).
+
     :returns:
         A list of extraction status in a Resonite compatible format.
     """
     if check_perms(request.data):
-        return Subtitle.extract_status()
+        return Subtitle.extract_status(*status_args())
+    return access_denied()
+
+@app.route('/extract_status/<task_uuid>', methods=['POST'])
+def job_status(task_uuid: str) -> str:
+    """Return the status of an extraction job.
+
+    First checks if the request contains a valid and non-revoked authorization key.
+    If the authorization is successful, it returns the status of the job with the
+    id returned in the `X-Job-Id` header of the extraction request. If the
+    authorization fails, it returns an access denied response.
+
+    QUERY PARAMETERS:
+        - since (:py:class:`int`, optional): The `X-Since` header of the previous response.
+        - wait (:py:class:`float`, optional): With `since`, the maximum time in seconds to wait
+        for a change before answering (default: 0, at most `EXTRACT_STATUS_MAX_WAIT`).
+
+    :params task_uuid: The unique identifier of the extraction job.
+
+    :returns:
+        The extraction status in a Resonite compatible format.
+    """
+    if check_perms(request.data):
+        return Subtitle.job_status(task_uuid, *status_args())
+    return access_denied()
+
+@app.route('/extract_events', methods=['POST'])
+def extract_events() -> Response:
+    """Stream the changes of the extraction status.
+
+    First checks if the request contains a valid and non-revoked authorization key.
+    If the authorization is successful, it returns a Server-Sent Events stream with
+    an event for each change of an extraction job, ended after
+    `EXTRACT_EVENTS_MAX_DURATION` seconds for the client to reconnect. If the
+    authorization fails, it returns an access denied response.
+
+    QUERY PARAMETERS:
+        - since (:py:class:`int`, optional): The id of the last event received, the
+        `Last-Event-ID` header is used too (default: only the new changes).
+
+    :returns:
+        A stream of events with the extraction status in a Resonite compatible format.
+    """
+    if check_perms(request.data):
+        since: Optional[int] = request.args.get('since', type=int)
+        if since is None:
+            since = request.headers.get('Last-Event-ID', type=int)
+        return Response(
+            stream_with_context(Subtitle.extract_events(since)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache'},
+        )
+    return access_denied()
+
+@app.route('/extract_metrics', methods=['POST'])
+def extract_metrics() -> str:
+    """Return the metrics of the extraction scheduler.
+
+    First checks if the request contains a valid and non-revoked authorization key.
+    If the authorization is successful, it returns the metrics of the extraction
+    scheduler. If the authorization fails, it returns an access denied response.
+
+    :returns:
+        The metrics in the format `queue_depth,downloading,ocr_pending,started,avg_wait,max_wait,converting`
+        where `avg_wait` and `max_wait` are the time spent in the queue in milliseconds.
+    """
+    if check_perms(request.data):
+        return extract_scheduler.metrics()
+    return access_denied()
+
+@app.route('/clean_metrics', methods=['POST'])
+def clean_metrics() -> str:
+    """Return the metrics of the subtitles cleaning.
+
+    First checks if the request contains a valid and non-revoked authorization key.
+    If the authorization is successful, it returns the number of subtitles cleaned
+    and the time spent by each cleaning rule. If the authorization fails, it returns
+    an access denied response.
+
+    :returns:
+        The metrics in the format `cleaned,skipped` followed by `rule,calls,total_ms,matches`
+        for each rule, the slowest first.
+    """
+    if check_perms(request.data):
+        return subtitle_cleaner.metrics()
     return access_denied()
 
+@app.route('/cache', methods=['POST'])
+def cache_status() -> str:
+    """Return the state of the catalog and PlaybackInfo caches.
+
+    First checks if the request contains a valid and non-revoked authorization key.
+    If the authorization is successful, it returns the caches counters. If the
+    authorization fails, it returns an access denied response.
+
+    :returns:
+        The counters of the catalog cache then of the PlaybackInfo cache, separated
+        by `;`, in the format `size,maxsize,hits,misses`.
+    """
+    if check_perms(request.data):
+        return f"{catalog_cache!r};{play_info_cache!r}"
+    return access_denied()
+
+@app.route('/cache/purge', methods=['POST'])
+def cache_purge() -> str:
+    """Purge the catalog and PlaybackInfo caches.
+
+    First checks if the request contains a valid and non-revoked authorization key.
+    If the authorization is successful, it drops every cached listing and PlaybackInfo
+    so the next requests are fetched again from Jellyfin. If the authorization fails,
+    it returns an access denied response.
+
+    :returns:
+        The number of cached entries dropped.
+    """
+    if check_perms(request.data):
+        return str(catalog_cache.clear() + play_info_cache.clear())
+    return access_denied()
+
+def serve(args: Namespace) -> None:
+    """Serve the app with the worker processes of gunicorn or uvicorn.
+
+    This process keeps running the extraction scheduler and the background
+    threads, and holds the extraction tasks, the caches and the subtitles
+    index, which the workers use through :py:mod:`jellyfin2txt.shared`.
+    """
+    env: dict = dict(os.environ)
+    env.update(shared.serve(Path(app.config['SUBTITLES_TMP']) / 'shared.sock'))
+    env[MOVIES_ID_ENV] = client.movies_id
+    env[SERIES_ID_ENV] = client.series_id
+    if args.server == 'gunicorn':
+        command: list = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'0.0.0.0:{args.port}',
+            '--workers', str(args.workers),
+            '--threads', str(args.threads),
+            'jellyfin2txt.app:app',
+        ]
+    else:
+        command: list = [
+            sys.executable, '-m', 'uvicorn',
+            '--host', '0.0.0.0',
+            '--port', str(args.port),
+            '--workers', str(args.workers),
+            '--interface', 'wsgi',
+            'jellyfin2txt.app:app',
+        ]
+    server: subprocess.Popen = subprocess.Popen(command, env=env)
+    # Stop the server first, then this process, when stopped by docker.
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.terminate())
+    try:
+        server.wait()
+    except KeyboardInterrupt:
+        # The server got the interruption too, let it stop.
+        server.wait()
+
 def main() -> None:
     parser: ArgumentParser = ArgumentParser()
     parser.add_argument(
@@ -319,6 +542,15 @@ def main() -> None:
     parser.add_argument(
         '--debug', action='store_true',
         help='Make the server verbose')
+    parser.add_argument(
+        '--server', choices=['flask', 'gunicorn', 'uvicorn'], default='flask',
+        help='Server to use, default the flask development server')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of worker processes of gunicorn or uvicorn, default 1')
+    parser.add_argument(
+        '--threads', type=int, default=8,
+        help='Number of threads of each gunicorn worker, default 8')
     args: Namespace = parser.parse_args()
 
     import logging
@@ -328,13 +560,18 @@ def main() -> None:
         for logger in loggers:
             logger.setLevel(logging.DEBUG)
 
-    media_folders: dict = client.jellyfin.get_media_folders()
-    item_ids: list = []
     items: dict = {}
-
-    for item in media_folders['Items']:
-        item_ids.append(item['Id'])
-        items[item['Name']]: str = item['Id']
+    if library_snapshot is not None:
+        items: dict = library_snapshot.load_media_folders()
+    wanted: list = [
+        (app.config.get('MOVIES_ID'), app.config.get('MOVIES')),
+        (app.config.get('SERIES_ID'), app.config.get('SERIES')),
+    ]
+    if any(
+        (folder_id and folder_id not in items.values()) or (not folder_id and name not in items)
+        for folder_id, name in wanted
+    ):
+        items: dict = library_index.fetch_media_folders()
 
     def item_not_found(item, key):
         logging.error('{} ({}) not found in:'.format(item, key))
@@ -342,33 +579,55 @@ def main() -> None:
             logging.error('{}: {}'.format(item_name, item_id))
         sys.exit(1)
 
-    if not app.config.get('MOVIES_ID'):
-        if app.config.get('MOVIES') not in items.keys():
-            item_not_found('MOVIES', app.config.get('MOVIES'))
-        else:
-            client.movies_id: str = items[app.config['MOVIES']]
-    if not app.config.get('SERIES_ID'):
-        if app.config.get('SERIES') not in items.keys():
-            item_not_found('SERIES', app.config.get('SERIES'))
-        else:
-            client.series_id: str = items[app.config['SERIES']]
-    if (
-        not getattr(client, 'movies_id', False) and
-        app.config.get('MOVIES_ID') not in items.values()
-    ):
-        item_not_found('MOVIES_ID', app.config.get('MOVIES_ID'))
-    if (
-        not getattr(client, 'series_id', False) and
-        app.config.get('SERIES_ID') not in items.values()
-    ):
-        item_not_found('SERIES_ID', app.config.get('SERIES_ID'))
-
-    task: Thread = Thread(
-        target=Subtitle.subtitle_extract_thread
+    # The ids are set before the library index and the server workers read them.
+    if app.config.get('MOVIES_ID'):
+        if app.config['MOVIES_ID'] not in items.values():
+            item_not_found('MOVIES_ID', app.config['MOVIES_ID'])
+        client.movies_id: str = app.config['MOVIES_ID']
+    elif app.config.get('MOVIES') not in items.keys():
+        item_not_found('MOVIES', app.config.get('MOVIES'))
+    else:
+        client.movies_id: str = items[app.config['MOVIES']]
+    if app.config.get('SERIES_ID'):
+        if app.config['SERIES_ID'] not in items.values():
+            item_not_found('SERIES_ID', app.config['SERIES_ID'])
+        client.series_id: str = app.config['SERIES_ID']
+    elif app.config.get('SERIES') not in items.keys():
+        item_not_found('SERIES', app.config.get('SERIES'))
+    else:
+        client.series_id: str = items[app.config['SERIES']]
+
+    stop: Event = Event()
+    # The store is loaded before the resumed jobs can look it up or save it.
+    subtitle_store.load_metadata()
+    subtitle_store.load_content()
+    subtitle_store.scan()
+    extract_scheduler.start()
+    store_task: Thread = Thread(
+        target=subtitle_store.watch_thread, args=(stop,), daemon=True
     )
-    task.start()
+    store_task.start()
+
+    if app.config.get('LIBRARY_INDEX'):
+        library_index.load_snapshot()
+        index_task: Thread = Thread(
+            target=library_index.refresh_thread, args=(stop,), daemon=True
+        )
+        index_task.start()
 
-    app.run(host='0.0.0.0', port=args.port)
+    try:
+        if args.server == 'flask':
+            # Leave the server like on ctrl-c when stopped by docker, so the
+            # jobs are stopped to be resumed and the metadata is saved.
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            app.run(host='0.0.0.0', port=args.port)
+        else:
+            serve(args)
+    finally:
+        stop.set()
+        extract_scheduler.shutdown()
+        subtitle_cleaner.shutdown()
+        subtitle_store.flush_metadata()
 
     client.stop()
 
@@ -0,0 +1,309 @@
+import re
+import heapq
+import logging
+from operator import itemgetter
+from typing import Iterable, Optional, TextIO
+
+
+OVERRIDE_RE: re.Pattern = re.compile(r'\{[^}]*\}')
+DRAWING_RE: re.Pattern = re.compile(r'\\p([0-9]+)')
+TIME_RE: re.Pattern = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})[.:](\d{1,3})')
+# The same patterns applied at once on the fields of a batch of dialogues,
+# joined by a NUL character which no override tag can span.
+BATCH_OVERRIDE_RE: re.Pattern = re.compile(r'\{[^}\x00]*\}')
+BATCH_TIMES_RE: re.Pattern = re.compile(r'\d+:[0-5]\d:[0-5]\d\.\d\d(?:\x00\d+:[0-5]\d:[0-5]\d\.\d\d)*')
+
+by_end: itemgetter = itemgetter(1)
+by_order: itemgetter = itemgetter(2)
+
+# The number of dialogues parsed together, the regular expressions and the
+# string methods are run once for the whole batch instead of once per line.
+BATCH_SIZE: int = 256
+
+
+def srt_time(ms: int) -> str:
+    return '%02d:%02d:%02d,%03d' % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+
+def ass_time(value: str) -> int:
+    """Convert an ASS time, `H:MM:SS.cc`, in milliseconds."""
+    match: Optional[re.Match] = TIME_RE.match(value.strip())
+    if match is None:
+        raise ValueError(f'Invalid ASS time {value}')
+    hours, minutes, seconds, fraction = match.groups()
+    return (
+        int(hours) * 3600000 + int(minutes) * 60000 + int(seconds) * 1000
+        + int(fraction.ljust(3, '0'))
+    )
+
+
+def ass_text(text: str) -> str:
+    """Return the text of an event without its override tags and drawings."""
+    if '{' not in text and '\\' not in text:
+        return text.strip()
+    if '\\p' not in text or DRAWING_RE.search(text) is None:
+        parts: list = [OVERRIDE_RE.sub('', text)]
+    else:
+        parts: list = ass_drawings(text)
+    text = ''.join(parts).replace('\\N', '\n').replace('\\n', '\n').replace('\\h', ' ')
+    if '\n' not in text:
+        return text.strip()
+    return '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+
+
+def ass_drawings(text: str) -> list:
+    """Return the parts of a text outside of its override tags and drawings."""
+    parts: list = []
+    drawing: bool = False
+    position: int = 0
+    for match in OVERRIDE_RE.finditer(text):
+        if not drawing:
+            parts.append(text[position:match.start()])
+        for level in DRAWING_RE.findall(match.group()):
+            drawing = level != '0'
+        position = match.end()
+    if not drawing:
+        parts.append(text[position:])
+    return parts
+
+
+def time_key(ms: int) -> int:
+    """Return the key of a time ordering the times, its srt digits `HHMMSSmmm` as an integer."""
+    return ms // 3600000 * 10000000 + ms // 60000 % 60 * 100000 + ms // 1000 % 60 * 1000 + ms % 1000
+
+
+def batch_times(values: list) -> (list, list):
+    """Return the keys and the srt times of ASS times, None for the invalid ones.
+
+    The times are only compared and written again, so they are not
+    converted in milliseconds but read as their digits, see :py:func:`time_key`.
+    """
+    joined: str = '\x00'.join(values)
+    if BATCH_TIMES_RE.fullmatch(joined):
+        # Every time is `H:MM:SS.cc`, the hours of one digit are padded in srt.
+        digits: str = joined.replace(':', '').replace('.', '').replace('\x00', '0\x00') + '0'
+        srt: str = '\x00' + joined.replace('.', ',').replace('\x00', '0\x00') + '0'
+        for digit in '0123456789':
+            srt = srt.replace(f'\x00{digit}:', f'\x000{digit}:')
+        return list(map(int, digits.split('\x00'))), srt[1:].split('\x00')
+    keys: list = []
+    srts: list = []
+    for value in values:
+        try:
+            ms: int = ass_time(value)
+        except ValueError:
+            keys.append(None)
+            srts.append(None)
+            continue
+        keys.append(time_key(ms))
+        srts.append(srt_time(ms))
+    return keys, srts
+
+
+def batch_texts(texts: list) -> list:
+    """Return the texts of events without their override tags and drawings."""
+    joined: str = '\x00'.join(texts)
+    if joined.count('\x00') != len(texts) - 1 or ('\\p' in joined and DRAWING_RE.search(joined)):
+        return [ass_text(text) for text in texts]
+    if '{' in joined:
+        joined = BATCH_OVERRIDE_RE.sub('', joined)
+    if '\\' in joined:
+        joined = joined.replace('\\N', '\n').replace('\\n', '\n').replace('\\h', ' ')
+    if '\n' in joined:
+        # Strip the lines of the texts and drop the empty ones.
+        joined = '\n'.join(map(str.strip, joined.split('\n')))
+        while '\n\n' in joined:
+            joined = joined.replace('\n\n', '\n')
+    return [text.strip() for text in joined.split('\x00')]
+
+
+def parse_dialogues(lines: list, fields: tuple, order: int) -> list:
+    """Return the events of `Dialogue:` lines, numbered in order from `order + 1`.
+
+    An event is the tuple `(start, end, order, text, srt_start, srt_end)`,
+    see :py:func:`batch_times` for the times.
+    """
+    start_index, end_index, text_index = fields
+    rows: list = [line[9:].split(',', text_index) for line in lines]
+    rows = [row for row in rows if len(row) > text_index]
+    starts, srt_starts = batch_times([row[start_index] for row in rows])
+    ends, srt_ends = batch_times([row[end_index] for row in rows])
+    texts: list = batch_texts([row[text_index].rstrip('\r\n') for row in rows])
+    events: list = []
+    for start, end, text, srt_start, srt_end in zip(starts, ends, texts, srt_starts, srt_ends):
+        if text and start is not None and end is not None and end > start:
+            order += 1
+            events.append((start, end, order, text, srt_start, srt_end))
+    return events
+
+
+def read_events(lines: Iterable[str]) -> Iterable[list]:
+    """Read the dialogues of an ASS/SSA file as `(start, end, order, text)`.
+
+    The lines are read one at a time and the dialogues parsed and yielded
+    by batches of :py:data:`BATCH_SIZE`.
+    """
+    in_events: bool = False
+    fields: Optional[tuple] = None
+    order: int = 0
+    batch: list = []
+    for line in lines:
+        if line.startswith('Dialogue:'):
+            if in_events and fields is not None:
+                batch.append(line)
+                if len(batch) >= BATCH_SIZE:
+                    events: list = parse_dialogues(batch, fields, order)
+                    order += len(events)
+                    batch = []
+                    yield events
+            continue
+        line = line.strip()
+        if line.startswith('['):
+            in_events = line.lower() == '[events]'
+        elif in_events and line.startswith('Format:'):
+            names: list = [name.strip().lower() for name in line[7:].split(',')]
+            if {'start', 'end', 'text'}.issubset(names) and names[-1] == 'text':
+                if batch:
+                    # The dialogues read belong to the previous format.
+                    events: list = parse_dialogues(batch, fields, order)
+                    order += len(events)
+                    batch = []
+                    yield events
+                fields = (names.index('start'), names.index('end'), names.index('text'))
+    if batch:
+        yield parse_dialogues(batch, fields, order)
+
+
+def sort_events(batches: Iterable[list], window: int) -> Iterable[tuple]:
+    """Sort the events by start time, at most `window` events out of order."""
+    heap: list = []
+    for events in batches:
+        for event in events:
+            if len(heap) < window:
+                heapq.heappush(heap, event)
+            else:
+                yield heapq.heappushpop(heap, event)
+    while heap:
+        yield heapq.heappop(heap)
+
+
+class SrtWriter:
+    """Write the cues of a srt file, merging a cue with the previous one when
+    they follow each other with the same text. The cues are written by
+    batches of :py:data:`BATCH_SIZE`."""
+
+    def __init__(self, out: TextIO) -> None:
+        self.out: TextIO = out
+        self.number: int = 0
+        self.pending: Optional[list] = None
+        self.buffer: list = []
+
+    def cue(self, start: int, end: int, text: str, srt_start: str, srt_end: str) -> None:
+        pending: Optional[list] = self.pending
+        if pending is not None:
+            if pending[1] == start and pending[2] == text:
+                pending[1], pending[4] = end, srt_end
+                return
+            self._write(pending[2], pending[3], pending[4])
+        self.pending = [start, end, text, srt_start, srt_end]
+
+    def _write(self, text: str, srt_start: str, srt_end: str) -> None:
+        self.number += 1
+        self.buffer.append(f"{self.number}\n{srt_start} --> {srt_end}\n{text}\n\n")
+        if len(self.buffer) >= BATCH_SIZE:
+            self.out.write(''.join(self.buffer))
+            self.buffer = []
+
+    def flush(self) -> None:
+        if self.pending is not None:
+            self._write(*self.pending[2:])
+            self.pending = None
+        self.out.write(''.join(self.buffer))
+        self.buffer = []
+
+
+def convert(lines: Iterable[str], out: TextIO, window: int = 512) -> int:
+    """Convert an ASS/SSA subtitle in srt and return the number of cues written.
+
+    The lines are read and the cues written as they come, only the events
+    displayed at the same time and the last `window` events, to sort the
+    files not ordered by time, are kept in memory. The events displayed at
+    the same time are merged in a cue for each period where the same events
+    are displayed, as srt players do not handle the overlapping cues.
+
+    :param lines: The lines of the ASS/SSA file.
+    :param out: Where the srt is written.
+    :param window: The maximum number of events read in advance to sort them.
+    """
+    writer: SrtWriter = SrtWriter(out)
+    active: list = []
+    # The time up to which the cues are written, and the same time in srt.
+    cursor: Optional[int] = None
+    srt_cursor: Optional[str] = None
+
+    def advance(until: int, srt_until: str) -> None:
+        nonlocal active, cursor, srt_cursor
+        while active and cursor < until:
+            if len(active) == 1:
+                event: tuple = active[0]
+                if event[1] > until:
+                    writer.cue(cursor, until, event[3], srt_cursor, srt_until)
+                    break
+                writer.cue(cursor, event[1], event[3], srt_cursor, event[5])
+                active = []
+                break
+            if len(active) == 2:
+                # Two events displayed together, the common case of the overlaps.
+                one, other = active if active[0][2] < active[1][2] else active[::-1]
+                text: str = one[3] if one[3] == other[3] else f"{one[3]}\n{other[3]}"
+                first, second = (one, other) if one[1] <= other[1] else (other, one)
+                if first[1] > until:
+                    writer.cue(cursor, until, text, srt_cursor, srt_until)
+                    break
+                writer.cue(cursor, first[1], text, srt_cursor, first[5])
+                cursor, srt_cursor = first[1], first[5]
+                active = [second] if second[1] > cursor else []
+                continue
+            else:
+                first: tuple = min(active, key=by_end)
+                texts: list = []
+                for event in sorted(active, key=by_order):
+                    if event[3] not in texts:
+                        texts.append(event[3])
+                text: str = '\n'.join(texts)
+            if first[1] < until:
+                stop, srt_stop = first[1], first[5]
+            else:
+                stop, srt_stop = until, srt_until
+            writer.cue(cursor, stop, text, srt_cursor, srt_stop)
+            cursor, srt_cursor = stop, srt_stop
+            if stop == first[1]:
+                active = [event for event in active if event[1] > stop]
+        cursor, srt_cursor = until, srt_until
+
+    for event in sort_events(read_events(lines), window):
+        start: int = event[0]
+        if cursor is None:
+            cursor, srt_cursor = start, event[4]
+        elif start < cursor:
+            if event[1] <= cursor:
+                logging.warning(f'Dropping the subtitle event at {event[4]}, too far out of order')
+                continue
+            event = (cursor,) + event[1:4] + (srt_cursor, event[5])
+            start = cursor
+        if not active:
+            cursor, srt_cursor = start, event[4]
+        elif len(active) == 1 and active[0][1] <= start:
+            # The previous event ends before this one, the common case.
+            previous: tuple = active[0]
+            writer.cue(cursor, previous[1], previous[3], srt_cursor, previous[5])
+            active = []
+            cursor, srt_cursor = start, event[4]
+        else:
+            advance(start, event[4])
+        active.append(event)
+    if active:
+        last: tuple = max(active, key=by_end)
+        advance(last[1], last[5])
+    writer.flush()
+    return writer.number
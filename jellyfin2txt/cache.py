@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+
+class _Missing:
+    """Marker of a missing entry, unpickled as the same object so it can be
+    passed to a cache of another process."""
+
+    def __reduce__(self) -> str:
+        return 'MISSING'
+
+
+MISSING: _Missing = _Missing()
+
+
+class TTLCache:
+    """Size-bounded LRU cache where each entry expires after ``ttl`` seconds.
+
+    :param maxsize: The maximum number of entries kept, the least recently
+        used entry is evicted first.
+    :param ttl: The lifetime of an entry in seconds.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300) -> None:
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock: Lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry: tuple = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Return the cached value for ``key`` or compute and store it."""
+        value: Any = self.get(key, MISSING)
+        if value is MISSING:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> int:
+        """Drop every entry and return how many were dropped."""
+        with self._lock:
+            size: int = len(self._data)
+            self._data.clear()
+            return size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"{len(self._data)},{self.maxsize},{self.hits},{self.misses}"
@@ -0,0 +1,206 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+
+import pysrt
+from cleanit import Config as cleanitConfig
+from cleanit import Subtitle as cleanitSubtitle
+from cleanit.rule import Rules
+
+from jellyfin2txt.config import app
+from jellyfin2txt.shared import shared
+from jellyfin2txt.utils import process_pool
+
+_rules: Optional[Rules] = None
+_language_rules: dict = {}
+
+
+def _init_worker(tags: list) -> None:
+    """Compile the rules once in each worker process."""
+    global _rules
+    _rules = cleanitConfig().select_rules(tags=set(tags))
+
+
+def _select(language) -> Rules:
+    rules: Optional[Rules] = _language_rules.get(language)
+    if rules is None:
+        rules = _language_rules[language] = Rules(rules=_rules, tags=_rules.tags, languages={language})
+    return rules
+
+
+def _apply(rules: Rules, text: str, timings: dict) -> (Optional[str], bool):
+    """Apply the rules like :py:meth:`cleanit.rule.Rules.apply`, timing each rule.
+
+    The rules are applied from the first one again after each match, until
+    none matches or the text is removed.
+    """
+    modified: bool = False
+    while True:
+        for rule in rules:
+            start: float = perf_counter()
+            result, matches = rule.apply(text)
+            timing: list = timings.setdefault(rule.name, [0, 0.0, 0])
+            timing[0] += 1
+            timing[1] += perf_counter() - start
+            if matches:
+                timing[2] += 1
+                modified = True
+                if not result:
+                    return result, modified
+                text = result
+                break
+        else:
+            return text, modified
+
+
+def clean_file(path: str) -> (bool, dict):
+    """Clean a srt file in place and return if it changed and the time spent per rule.
+
+    This runs inside a cleaning worker process.
+    """
+    timings: dict = {}
+    sub: cleanitSubtitle = cleanitSubtitle(path)
+    sub.encoding = sub.guess_encoding()
+    sub.subtitle = pysrt.open(path, encoding=sub.encoding)
+    rules: Rules = _select(sub.language)
+    modified: bool = False
+    for index, item in reversed(list(enumerate(sub.subtitle))):
+        text, changed = _apply(rules, item.text, timings)
+        if changed:
+            modified = True
+            if not text:
+                del sub.subtitle[index]
+            else:
+                item.text = text
+    if modified:
+        sub.subtitle.clean_indexes()
+        sub.save(encoding='utf-8')
+    return modified, timings
+
+
+class Cleaner:
+    """Clean the subtitles with the cleanit rules matching `tags`.
+
+    The rules are compiled once by each process of the pool running the
+    cleaning. The hash of each file cleaned is recorded with the hash of
+    the result, and the results are kept in `cache_folder`, so a file
+    already cleaned, or identical to a file already cleaned, is not cleaned
+    again. The time spent by each rule is summed, see :py:meth:`metrics`.
+
+    :param tags: The tags of the cleanit rules applied.
+    :param workers: The number of processes cleaning the files.
+    :param cache_folder: The folder of the cleaned files and of their hashes.
+    """
+
+    def __init__(self, tags: list, workers: int = 1, cache_folder: Path = None) -> None:
+        self.pool: ProcessPoolExecutor = process_pool(workers, _init_worker, (list(tags),))
+        self.cache_folder: Optional[Path] = Path(cache_folder) if cache_folder else None
+        self.hashes: dict = {}
+        self.timings: dict = {}
+        self.cleaned: int = 0
+        self.skipped: int = 0
+        self._lock: Lock = Lock()
+        self._save_lock: Lock = Lock()
+        if self.cache_folder is not None:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    @property
+    def _hashes_file(self) -> Path:
+        return self.cache_folder / 'hashes.json'
+
+    def _load(self) -> None:
+        try:
+            with open(self._hashes_file, 'r') as file:
+                self.hashes = json.load(file)
+        except FileNotFoundError:
+            pass
+        except json.decoder.JSONDecodeError:
+            logging.warning(f'Ignoring corrupted cleaning cache {self._hashes_file}')
+
+    def _save(self) -> None:
+        tmp_file: Path = self._hashes_file.with_suffix('.tmp')
+        with self._save_lock:
+            with self._lock:
+                hashes: dict = dict(self.hashes)
+            with open(tmp_file, 'w') as file:
+                json.dump(hashes, file)
+            os.replace(tmp_file, self._hashes_file)
+
+    @staticmethod
+    def _digest(path: Path) -> str:
+        with open(path, 'rb') as file:
+            return hashlib.file_digest(file, 'sha256').hexdigest()
+
+    def _reuse(self, path: Path, digest: str) -> bool:
+        """Replace `path` with the result of its previous cleaning if known."""
+        if self.cache_folder is None:
+            return False
+        result: Optional[str] = self.hashes.get(digest)
+        if result is None:
+            return False
+        if result != digest:
+            cached: Path = self.cache_folder / f"{result}.srt"
+            if not cached.is_file():
+                return False
+            shutil.copyfile(cached, path)
+        return True
+
+    def clean(self, path: Path) -> None:
+        path = Path(path)
+        digest: str = self._digest(path)
+        if self._reuse(path, digest):
+            logging.info(f'{path.name} already cleaned')
+            with self._lock:
+                self.skipped += 1
+            return
+        logging.info('Starting cleaning sub...')
+        try:
+            modified, timings = self.pool.submit(clean_file, str(path)).result()
+        except Exception as err:
+            logging.warning(f"Error while trying to clean {path.name}: <{type(err).__name__}> [{err}]")
+            return
+        with self._lock:
+            self.cleaned += 1
+            for name, (calls, seconds, matches) in timings.items():
+                timing: list = self.timings.setdefault(name, [0, 0.0, 0])
+                timing[0] += calls
+                timing[1] += seconds
+                timing[2] += matches
+        if self.cache_folder is None:
+            return
+        result: str = self._digest(path) if modified else digest
+        if modified:
+            shutil.copyfile(path, self.cache_folder / f"{result}.srt")
+        with self._lock:
+            self.hashes[digest] = result
+            self.hashes[result] = result
+        self._save()
+
+    def metrics(self) -> str:
+        """Return `cleaned,skipped` then `rule,calls,total_ms,matches` per rule, slowest first."""
+        with self._lock:
+            rules: list = sorted(self.timings.items(), key=lambda timing: timing[1][1], reverse=True)
+            lines: list = [f"{self.cleaned},{self.skipped}"]
+            lines.extend(
+                f"{name},{calls},{seconds * 1000:.1f},{matches}"
+                for name, (calls, seconds, matches) in rules
+            )
+        return ';'.join(lines)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+subtitle_cleaner: Cleaner = shared('subtitle_cleaner', lambda: Cleaner(
+    app.config.get('CLEAN_TAGS', ['no-style', 'ocr', 'tidy', 'no-spam']),
+    workers=app.config.get('CLEAN_WORKERS', 1),
+    cache_folder=app.config.get('CLEAN_CACHE', '/tmp/jellyfin2txt/clean'),
+))
@@ -9,6 +9,9 @@ from queue import Queue
 from babelfish import Language
 
 from jellyfin2txt.utils import ExtractTasks, Jellyfin2TextSerializer
+from jellyfin2txt.cache import TTLCache
+from jellyfin2txt.jobs import JobStore
+from jellyfin2txt.shared import CacheProxy, shared
 
 class Settings:
     transcode_h265 = False
@@ -76,8 +79,21 @@ except ValueError as err:
     logging.error(err)
     exit(1)
 
-extract_queue: Queue = Queue()
-extract_tasks: dict = ExtractTasks()
+extract_queue: Queue = shared('extract_queue', Queue)
+extract_tasks: ExtractTasks = shared('extract_tasks', lambda: ExtractTasks(
+    retention=app.config.get('EXTRACT_TASKS_RETENTION', 3600),
+    max_finished=app.config.get('EXTRACT_TASKS_MAX', 1000),
+    store=JobStore(app.config['EXTRACT_JOBS']) if app.config.get('EXTRACT_JOBS') else None,
+))
+
+catalog_cache: TTLCache = shared('catalog_cache', lambda: TTLCache(
+    maxsize=app.config.get('CATALOG_CACHE_SIZE', 512),
+    ttl=app.config.get('CATALOG_CACHE_TTL', 300),
+), CacheProxy)
+play_info_cache: TTLCache = shared('play_info_cache', lambda: TTLCache(
+    maxsize=app.config.get('PLAY_INFO_CACHE_SIZE', 256),
+    ttl=app.config.get('PLAY_INFO_CACHE_TTL', 600),
+), CacheProxy)
 
 subs_providers_lang: list = app.config['SUBS_PROVIDERS_LANGS']
 subs_providers_lang_set: set = set()
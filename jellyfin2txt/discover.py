@@ -0,0 +1,215 @@
+import os
+import json
+import stat
+import pickle
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from time import time
+from typing import Optional
+
+from babelfish import Language
+from subliminal import ProviderPool, Video
+from subliminal.extensions import provider_manager
+from subliminal.score import compute_score
+
+from jellyfin2txt.config import app
+
+
+class Discoverer:
+    """Search the subtitle providers for the subtitles of a video.
+
+    The providers are queried concurrently, each one for at most `timeout`
+    seconds so a slow or down provider does not delay the others. The
+    candidates found and the text of the best subtitle are cached on disk
+    per video name and language, so a video is searched only once. A
+    language without subtitle is searched again after `retry_after` seconds.
+    The candidates are pickled, so the folder must only be writable by the
+    server, otherwise they are not cached.
+
+    :param folder: The folder of the cache.
+    :param providers: The names of the subliminal providers queried.
+    :param provider_configs: The configuration of the providers.
+    :param timeout: The maximum time in seconds given to a provider to search
+        or to download a subtitle.
+    :param retry_after: The time in seconds a language without subtitle is
+        not searched again.
+    """
+
+    def __init__(
+        self,
+        folder: Path,
+        providers: list,
+        provider_configs: dict,
+        timeout: float = 20,
+        retry_after: int = 86400,
+    ) -> None:
+        self.folder: Path = Path(folder)
+        self.providers: list = providers
+        self.provider_configs: dict = provider_configs
+        self.timeout: float = timeout
+        self.retry_after: int = retry_after
+        self.folder.mkdir(parents=True, exist_ok=True, mode=0o700)
+        self.private: bool = self._private(self.folder)
+        if not self.private:
+            logging.warning(f"{self.folder} is writable by other users, the candidates are not cached")
+
+    @staticmethod
+    def _private(folder: Path) -> bool:
+        """Return if only the server can write in the folder, tightening it if needed."""
+        try:
+            if folder.stat().st_uid == os.getuid():
+                folder.chmod(0o700)
+            for path in (folder, folder.parent):
+                info: os.stat_result = path.stat()
+                if info.st_uid not in (os.getuid(), 0):
+                    return False
+                if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not info.st_mode & stat.S_ISVTX:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def _entry(self, video_name: str) -> Path:
+        return self.folder / hashlib.sha1(video_name.encode('utf-8')).hexdigest()
+
+    def cached(self, video_name: str, language: Language) -> Optional[str]:
+        """Return the cached text of the best subtitle of a video in a language."""
+        path: Path = self._entry(video_name) / f"{language.alpha3}.srt"
+        if path.is_file():
+            return path.read_text(encoding='utf-8')
+        return None
+
+    def searched(self, video_name: str, language: Language) -> bool:
+        """Return if the language was searched recently without finding any subtitle."""
+        try:
+            with open(self._entry(video_name) / 'missing.json', 'r') as file:
+                missing: dict = json.load(file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return False
+        return missing.get(language.alpha3, 0) + self.retry_after > time()
+
+    def _save(self, video_name: str, name: str, data: bytes) -> None:
+        entry: Path = self._entry(video_name)
+        entry.mkdir(parents=True, exist_ok=True)
+        tmp_path: Path = entry / f".{name}.tmp"
+        tmp_path.write_bytes(data)
+        tmp_path.replace(entry / name)
+
+    def _save_missing(self, video_name: str, languages: set) -> None:
+        try:
+            with open(self._entry(video_name) / 'missing.json', 'r') as file:
+                missing: dict = json.load(file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            missing: dict = {}
+        for language in languages:
+            missing[language.alpha3] = time()
+        self._save(video_name, 'missing.json', json.dumps(missing).encode('utf-8'))
+
+    def _candidates(self, video_name: str, language: Language) -> Optional[list]:
+        if not self.private:
+            return None
+        try:
+            with open(self._entry(video_name) / f"{language.alpha3}.pickle", 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            # e.g. the classes of a subliminal upgrade no longer match the pickle.
+            logging.warning(f"Cannot read the cached candidates of {video_name}: {err}")
+            return None
+
+    def _search(self, pool: ProviderPool, executor: ThreadPoolExecutor, video: Video, languages: set) -> (list, bool):
+        """Return the subtitles found and if every provider answered."""
+        futures: dict = {
+            executor.submit(pool.list_subtitles_provider, provider, video, languages): provider
+            for provider in self.providers
+        }
+        done, not_done = wait(futures, timeout=self.timeout)
+        for future in not_done:
+            logging.warning(f"Provider {futures[future]} timed out searching {video.name}")
+        complete: bool = not not_done
+        subtitles: list = []
+        for future in done:
+            try:
+                result: Optional[list] = future.result()
+            except Exception as err:
+                logging.warning(f"Provider {futures[future]} failed searching {video.name}: {err}")
+                result = None
+            if result is None:
+                # The provider failed, subliminal returns None instead of a list.
+                complete = False
+            subtitles.extend(result or [])
+        return subtitles, complete
+
+    def discover(self, video_name: str, languages: set) -> dict:
+        """Return the text of the best subtitle of a video for each language found.
+
+        The cached languages are not searched again, the others are searched
+        on all the providers at once.
+        """
+        found: dict = {}
+        candidates: dict = {}
+        for language in languages:
+            text: Optional[str] = self.cached(video_name, language)
+            if text is not None:
+                found[language] = text
+            elif not self.searched(video_name, language):
+                candidates[language] = self._candidates(video_name, language)
+        if not candidates:
+            return found
+
+        video: Video = Video.fromname(video_name)
+        executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max(1, len(self.providers)))
+        try:
+            with ProviderPool(providers=self.providers, provider_configs=self.provider_configs) as pool:
+                missing: set = {language for language, cached in candidates.items() if cached is None}
+                complete: bool = True
+                if missing:
+                    subtitles, complete = self._search(pool, executor, video, missing)
+                    for language in missing:
+                        candidates[language] = []
+                    for subtitle in subtitles:
+                        if subtitle.language in missing:
+                            candidates[subtitle.language].append(
+                                (compute_score(subtitle, video), subtitle)
+                            )
+                    for language in missing:
+                        candidates[language].sort(key=lambda candidate: candidate[0], reverse=True)
+                        if candidates[language] and self.private:
+                            self._save(video_name, f"{language.alpha3}.pickle", pickle.dumps(candidates[language]))
+                not_found: set = set()
+                for language, subtitles in candidates.items():
+                    text: Optional[str] = self._download(pool, executor, video_name, subtitles)
+                    if text is None:
+                        not_found.add(language)
+                        continue
+                    self._save(video_name, f"{language.alpha3}.srt", text.encode('utf-8'))
+                    found[language] = text
+                if not_found and complete:
+                    # Only remember the languages not found by every provider.
+                    self._save_missing(video_name, not_found)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return found
+
+    def _download(self, pool: ProviderPool, executor: ThreadPoolExecutor, video_name: str, subtitles: list) -> Optional[str]:
+        """Download the best of the candidates and return its text."""
+        for _, subtitle in subtitles:
+            future = executor.submit(pool.download_subtitle, subtitle)
+            try:
+                if future.result(timeout=self.timeout) and subtitle.is_valid():
+                    return subtitle.text
+            except Exception as err:
+                logging.warning(f"Provider {subtitle.provider_name} failed downloading for {video_name}: {err}")
+        return None
+
+
+subtitle_discoverer: Discoverer = Discoverer(
+    app.config.get('DISCOVER_CACHE', '/tmp/jellyfin2txt/discover'),
+    app.config.get('DISCOVER_PROVIDERS') or sorted(provider_manager.names()),
+    app.config['SUBS_PROVIDERS'],
+    timeout=app.config.get('DISCOVER_TIMEOUT', 20),
+    retry_after=app.config.get('DISCOVER_RETRY_AFTER', 86400),
+)
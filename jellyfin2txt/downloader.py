@@ -0,0 +1,201 @@
+import os
+import shutil
+import logging
+from http.client import HTTPResponse
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Optional
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from jellyfin2txt.utils import DownloadInterrupted, sizeof_fmt
+
+
+class Downloader:
+    """Resumable HTTP downloader.
+
+    The data is written in a `.part` file renamed once complete. An
+    interrupted download restarts from the size of its `.part` file with a
+    `Range` request. When the server accepts ranges and several connections
+    are allowed, the file is split in segments downloaded in parallel, each
+    one in its own `.partN` file so each can be resumed separately.
+
+    :param buffer_size: The size of the chunks read from the network.
+    :param connections: The maximum number of connections used for a file.
+    :param progress_interval: The minimum interval in seconds between two
+        progress reports.
+    """
+
+    min_segment_size: int = 64 * 1024 * 1024
+
+    def __init__(
+        self,
+        buffer_size: int = 1024 * 1024,
+        connections: int = 1,
+        progress_interval: float = 5,
+    ) -> None:
+        self.buffer_size: int = buffer_size
+        self.connections: int = max(1, connections)
+        self.progress_interval: float = progress_interval
+
+    @staticmethod
+    def _open(url: str, start: int = 0, end: Optional[int] = None) -> HTTPResponse:
+        request: Request = Request(url)
+        if start or end is not None:
+            request.add_header('Range', f"bytes={start}-{'' if end is None else end}")
+        return urlopen(request)
+
+    @staticmethod
+    def _total_size(response: HTTPResponse) -> int:
+        content_range: Optional[str] = response.headers.get('Content-Range')
+        if content_range:
+            return int(content_range.rsplit('/', 1)[1])
+        return int(response.headers['Content-Length'])
+
+    def _probe(self, url: str) -> (int, bool):
+        """Return the size of the file and if the server accepts ranges."""
+        response: HTTPResponse = self._open(url, 0, 0)
+        with response:
+            return self._total_size(response), response.status == 206
+
+    def _copy(
+        self,
+        response: HTTPResponse,
+        part: Path,
+        progress: Callable[[int], None],
+        stop: Optional[Event],
+        append: bool,
+    ) -> None:
+        with response, open(part, 'ab' if append else 'wb') as dest_file:
+            while True:
+                if stop is not None and stop.is_set():
+                    raise DownloadInterrupted(f"Download of {part} interrupted")
+                data: bytes = response.read(self.buffer_size)
+                if not data:
+                    return
+                dest_file.write(data)
+                progress(len(data))
+
+    def _fetch(
+        self,
+        url: str,
+        part: Path,
+        start: int,
+        end: Optional[int],
+        progress: Callable[[int], None],
+        stop: Optional[Event],
+    ) -> None:
+        done: int = part.stat().st_size if part.is_file() else 0
+        if end is not None and start + done > end:
+            return
+        try:
+            response: HTTPResponse = self._open(url, start + done, end)
+        except HTTPError as err:
+            if err.code == 416:
+                # The part already holds everything the server has.
+                return
+            raise
+        ranged: bool = bool(start + done) or end is not None
+        if ranged and response.status != 206:
+            if start or end is not None:
+                # The whole file cannot be written in a segment of it.
+                response.close()
+                raise OSError(f'Server ignored the range request of {part}')
+            logging.warning(f'Server ignored the range request, restarting {part}')
+            progress(-done)
+            done = 0
+        self._copy(response, part, progress, stop, append=bool(done))
+
+    def download(
+        self,
+        url: str,
+        path: Path,
+        stop: Optional[Event] = None,
+        progress: Optional[Callable[[int, int, float], None]] = None,
+    ) -> int:
+        """Download `url` in `path` and return the size of the file.
+
+        :param progress: Called with the bytes done, the total size and the
+            throughput in bytes per second, at most every `progress_interval`.
+        """
+        path = Path(path)
+        if path.is_file():
+            logging.warning('File already exist, ignoring dl...')
+            return path.stat().st_size
+        total, accept_ranges = self._probe(url)
+        connections: int = self.connections if accept_ranges else 1
+        connections = max(1, min(connections, total // self.min_segment_size))
+        if connections == 1:
+            segments: list = [(path.with_name(path.name + '.part'), 0, None)]
+        else:
+            size: int = total // connections
+            segments: list = [
+                (
+                    path.with_name(f"{path.name}.part{index}"),
+                    index * size,
+                    total - 1 if index == connections - 1 else (index + 1) * size - 1,
+                )
+                for index in range(connections)
+            ]
+
+        lock: Lock = Lock()
+        state: dict = {
+            'done': sum(
+                # The first segment holds more when its concatenation was interrupted.
+                min(part.stat().st_size, total - start if end is None else end + 1 - start)
+                for part, start, end in segments if part.is_file()
+            ),
+            'reported_at': monotonic(),
+            'reported_done': 0,
+        }
+        state['reported_done'] = state['done']
+        hz_total: str = sizeof_fmt(total)
+
+        def report(size: int) -> None:
+            with lock:
+                state['done'] += size
+                now: float = monotonic()
+                elapsed: float = now - state['reported_at']
+                if elapsed < self.progress_interval and state['done'] < total:
+                    return
+                speed: float = (state['done'] - state['reported_done']) / elapsed if elapsed else 0
+                state['reported_at'], state['reported_done'] = now, state['done']
+            logging.info(f"{path.name}: {sizeof_fmt(state['done'])} / {hz_total} ({sizeof_fmt(speed)}/s)")
+            if progress is not None:
+                progress(state['done'], total, speed)
+
+        if connections == 1:
+            self._fetch(url, segments[0][0], 0, None, report, stop)
+            os.replace(segments[0][0], path)
+            return path.stat().st_size
+
+        errors: list = []
+
+        def fetch_segment(part: Path, start: int, end: int) -> None:
+            try:
+                self._fetch(url, part, start, end, report, stop)
+            except Exception as err:
+                errors.append(err)
+
+        threads: list = [Thread(target=fetch_segment, args=segment) for segment in segments]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        # The other segments are appended to the first one, renamed once
+        # complete, so the data is copied once. The first segment is cut to
+        # its size first, an interrupted concatenation is then started again.
+        first_part, _, first_end = segments[0]
+        with open(first_part, 'r+b') as dest_file:
+            dest_file.truncate(first_end + 1)
+            dest_file.seek(0, os.SEEK_END)
+            for part, _, _ in segments[1:]:
+                with open(part, 'rb') as src_file:
+                    shutil.copyfileobj(src_file, dest_file, self.buffer_size)
+        os.replace(first_part, path)
+        for part, _, _ in segments[1:]:
+            part.unlink()
+        return path.stat().st_size
@@ -0,0 +1,90 @@
+import heapq
+from itertools import count
+from threading import Condition
+from typing import Any, Hashable, Optional
+
+
+class FairQueue:
+    """Blocking queue shared fairly between the owners of its items.
+
+    Each owner, e.g. an auth key, has its own queue where the items with
+    the lowest priority come first, then in the order they were put. The
+    owners take turns: :py:meth:`get` returns the item with the lowest
+    priority among the first items of the owners, the owner served the
+    least recently, or never, winning the ties. An owner with `max_running`
+    items not marked as :py:meth:`done` yet is skipped, so one owner
+    queueing many items cannot take every worker.
+
+    :param max_running: The maximum number of items of an owner being
+        processed at the same time, unlimited when 0.
+    """
+
+    def __init__(self, max_running: int = 0) -> None:
+        self.max_running: int = max_running
+        self._queues: dict = {}
+        self._running: dict = {}
+        self._served: dict = {}
+        self._sentinels: int = 0
+        self._size: int = 0
+        self._counter: count = count()
+        self._cond: Condition = Condition()
+
+    def put(self, item: Any, owner: Hashable = None, priority: int = 0) -> None:
+        """Queue an item, `None` wakes up one consumer with `None` to stop it."""
+        with self._cond:
+            if item is None:
+                self._sentinels += 1
+            else:
+                queue: list = self._queues.setdefault(owner, [])
+                heapq.heappush(queue, (priority, next(self._counter), item))
+                self._size += 1
+            self._cond.notify()
+
+    def _ready(self) -> Optional[Hashable]:
+        best: Optional[tuple] = None
+        for owner, queue in self._queues.items():
+            if self.max_running and self._running.get(owner, 0) >= self.max_running:
+                continue
+            rank: tuple = (queue[0][0], self._served.get(owner, -1))
+            if best is None or rank < best[0]:
+                best = (rank, owner)
+        return None if best is None else best[1]
+
+    def get(self) -> Any:
+        """Remove and return the next item, blocking until one is ready.
+
+        The item is counted as running for its owner until :py:meth:`done`.
+        """
+        with self._cond:
+            while True:
+                if self._sentinels:
+                    self._sentinels -= 1
+                    return None
+                owner: Optional[Hashable] = self._ready()
+                if owner is not None:
+                    break
+                self._cond.wait()
+            queue: list = self._queues[owner]
+            _, _, item = heapq.heappop(queue)
+            self._size -= 1
+            self._running[owner] = self._running.get(owner, 0) + 1
+            # The owner goes last in the turn.
+            self._served[owner] = next(self._counter)
+            if not queue:
+                del self._queues[owner]
+            return item
+
+    def done(self, owner: Hashable = None) -> None:
+        """Mark an item of `owner` returned by :py:meth:`get` as processed."""
+        with self._cond:
+            running: int = self._running.get(owner, 0) - 1
+            if running > 0:
+                self._running[owner] = running
+            else:
+                self._running.pop(owner, None)
+                if owner not in self._queues:
+                    self._served.pop(owner, None)
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        return self._size
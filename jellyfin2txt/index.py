@@ -0,0 +1,240 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from threading import Event
+from typing import Optional
+
+from jellyfin2txt.config import client, params, app
+from jellyfin2txt.snapshot import Snapshot
+from jellyfin2txt.shared import shared
+
+
+class Catalog:
+    """In-process index of every item of one type in a library folder.
+
+    Items are kept in a compact form with a list of ids presorted like
+    Jellyfin does (``SortName,ProductionYear``) and a tag to ids posting
+    list, so a page can be answered by slicing without touching the network.
+
+    :param item_type: The Jellyfin ``IncludeItemTypes`` value, e.g. `Movie`.
+    :param parent_id: The id of the library folder holding the items.
+    """
+
+    def __init__(self, item_type: str, parent_id: str) -> None:
+        self.item_type: str = item_type
+        self.parent_id: str = parent_id
+        self.items: dict = {}
+        self.sorted_ids: list = []
+        self.tags: dict = {}
+
+    @staticmethod
+    def _compact(item: dict) -> dict:
+        return {
+            'Id': item['Id'],
+            'Name': item['Name'],
+            'SortName': (item.get('SortName') or item['Name']).lower(),
+            'ProductionYear': item.get('ProductionYear') or 0,
+            'RemoteTrailers': (item.get('RemoteTrailers') or [])[:1],
+            'ExternalUrls': [
+                url for url in item.get('ExternalUrls') or [] if url['Name'] == 'IMDb'
+            ],
+            'Tags': item.get('Tags') or [],
+        }
+
+    def _rebuild(self, items: dict) -> None:
+        sorted_ids: list = sorted(
+            items,
+            key=lambda item_id: (
+                items[item_id]['SortName'],
+                items[item_id]['ProductionYear'],
+                item_id,
+            ),
+        )
+        tags: dict = {}
+        for position, item_id in enumerate(sorted_ids):
+            for tag in items[item_id]['Tags']:
+                tags.setdefault(tag, []).append(position)
+        # Swap the references at once so readers never see a partial index.
+        self.items, self.sorted_ids, self.tags = items, sorted_ids, tags
+
+    def load(self, items: list) -> None:
+        self._rebuild({item['Id']: item for item in items})
+
+    def update(self, items: list, removed: set = frozenset()) -> None:
+        new_items: dict = dict(self.items)
+        for item_id in removed:
+            new_items.pop(item_id, None)
+        for item in items:
+            new_items[item['Id']] = Catalog._compact(item)
+        self._rebuild(new_items)
+
+    def query(self, start_index: int = 0, limit: int = 100, tags: list = None) -> dict:
+        """Return a page in the same shape as a Jellyfin Items response."""
+        items, sorted_ids, posting = self.items, self.sorted_ids, self.tags
+        tags = [tag for tag in tags or [] if tag]
+        if tags:
+            positions: set = set()
+            for tag in tags:
+                positions.update(posting.get(tag, ()))
+            ids: list = [sorted_ids[position] for position in sorted(positions)]
+        else:
+            ids = sorted_ids
+        # Clamped as negative values would slice from the end of the list.
+        start_index, limit = max(0, int(start_index)), max(0, int(limit))
+        return {
+            'StartIndex': start_index,
+            'TotalRecordCount': len(ids),
+            'Items': [items[item_id] for item_id in ids[start_index:start_index + limit]],
+        }
+
+
+class LibraryIndex:
+    """Keep a :py:class:`Catalog` of the movies and the series up to date.
+
+    The first refresh pulls the whole library, the following ones only ask
+    Jellyfin for the items saved since the previous refresh. Each refresh
+    also lists the library folders again, so the folders configured by name
+    are followed when their id changes, e.g. a library created again.
+    """
+
+    # The attribute of the client holding the id of each folder and the
+    # config keys of its id and of its name.
+    folder_keys: tuple = (('movies_id', 'MOVIES_ID', 'MOVIES'), ('series_id', 'SERIES_ID', 'SERIES'))
+
+    page_size: int = 500
+    fields: str = 'RemoteTrailers,ExternalUrls,Tags,SortName,ProductionYear'
+
+    def __init__(self, snapshot: Optional[Snapshot] = None) -> None:
+        self.movies: Optional[Catalog] = None
+        self.series: Optional[Catalog] = None
+        self.ready: bool = False
+        self.last_refresh: Optional[datetime] = None
+        self.snapshot: Optional[Snapshot] = snapshot
+
+    def _catalogs(self) -> None:
+        if self.movies is None:
+            self.movies = Catalog('Movie', client.movies_id)
+            self.series = Catalog('Series', client.series_id)
+
+    def load_snapshot(self) -> None:
+        """Serve the listings from the on-disk snapshot until the next refresh."""
+        if self.snapshot is None:
+            return
+        self._catalogs()
+        last_refresh: Optional[datetime] = self.snapshot.load_last_refresh()
+        if last_refresh is None:
+            return
+        parent_ids: dict = {catalog.item_type: catalog.parent_id for catalog in [self.movies, self.series]}
+        if self.snapshot.load_parent_ids() != parent_ids:
+            # The snapshot belongs to other library folders, start from scratch.
+            return
+        for catalog in [self.movies, self.series]:
+            catalog.load(self.snapshot.load_catalog(catalog.item_type, catalog.parent_id))
+        self.last_refresh = last_refresh
+        self.ready = True
+        logging.info(
+            f'Library index loaded from {self.snapshot.path}: {len(self.movies.items)} movies, '
+            f'{len(self.series.items)} series'
+        )
+
+    def query(self, item_type: str, start_index: int = 0, limit: int = 100, tags: list = None) -> Optional[dict]:
+        """Return a page of the movies or the series, None until the index is ready.
+
+        :param item_type: `Movie` or `Series`.
+        """
+        if not self.ready:
+            return None
+        catalog: Catalog = self.movies if item_type == self.movies.item_type else self.series
+        return catalog.query(start_index, limit, tags)
+
+    def _fetch(self, catalog: Catalog, extra_params: dict, fields: str) -> list:
+        items: list = []
+        start_index: int = 0
+        while True:
+            index_params: dict = dict(params)
+            index_params.update(extra_params)
+            index_params['IncludeItemTypes']: str = catalog.item_type
+            index_params['ParentId']: str = catalog.parent_id
+            index_params['Fields']: str = fields
+            index_params['StartIndex']: int = start_index
+            index_params['Limit']: int = self.page_size
+            index_params['EnableImages']: bool = False
+            index_params['EnableUserData']: bool = False
+            page: dict = client.jellyfin.users('/Items', params=index_params)
+            items.extend(page['Items'])
+            start_index += len(page['Items'])
+            if not page['Items'] or start_index >= page['TotalRecordCount']:
+                return items
+
+    def _refresh_catalog(self, catalog: Catalog, since: Optional[datetime]) -> None:
+        if since is None:
+            catalog.update(self._fetch(catalog, {}, self.fields))
+            return
+        changed: list = self._fetch(
+            catalog,
+            {'MinDateLastSaved': since.strftime('%Y-%m-%dT%H:%M:%SZ')},
+            self.fields,
+        )
+        # Saved items do not tell about deleted ones, list the ids to find them.
+        ids: set = {item['Id'] for item in self._fetch(catalog, {}, '')}
+        removed: set = set(catalog.items) - ids
+        if changed or removed:
+            catalog.update(changed, removed)
+
+    def fetch_media_folders(self) -> dict:
+        """Return the ids of the library folders by name, saved in the snapshot."""
+        media_folders: dict = {
+            item['Name']: item['Id'] for item in client.jellyfin.get_media_folders()['Items']
+        }
+        if self.snapshot is not None:
+            self.snapshot.save_media_folders(media_folders)
+        return media_folders
+
+    def refresh_media_folders(self) -> bool:
+        """Update the ids of the folders configured by name and return if one changed."""
+        media_folders: dict = self.fetch_media_folders()
+        changed: bool = False
+        for attribute, id_key, name_key in self.folder_keys:
+            folder_id: Optional[str] = media_folders.get(app.config.get(name_key))
+            if app.config.get(id_key) or folder_id is None or folder_id == getattr(client, attribute):
+                continue
+            logging.warning(f'The library folder {app.config[name_key]} is now {folder_id}')
+            setattr(client, attribute, folder_id)
+            changed = True
+        return changed
+
+    def refresh(self) -> None:
+        self._catalogs()
+        movies, series, since = self.movies, self.series, self.last_refresh
+        if self.refresh_media_folders():
+            # Index the new folders from scratch, the old ones are served meanwhile.
+            movies, series = Catalog('Movie', client.movies_id), Catalog('Series', client.series_id)
+            since = None
+        # Overlap the previous window so clock drift with Jellyfin does not lose items.
+        started_at: datetime = datetime.now(timezone.utc) - timedelta(minutes=1)
+        for catalog in [movies, series]:
+            self._refresh_catalog(catalog, since)
+        self.movies, self.series = movies, series
+        self.last_refresh = started_at
+        self.ready = True
+        if self.snapshot is not None:
+            self.snapshot.save_catalogs([self.movies, self.series], started_at)
+        logging.info(
+            f'Library index refreshed: {len(self.movies.items)} movies, '
+            f'{len(self.series.items)} series'
+        )
+
+    def refresh_thread(self, stop: Event) -> None:
+        interval: int = app.config.get('LIBRARY_INDEX_REFRESH', 300)
+        while not stop.is_set():
+            try:
+                self.refresh()
+            except Exception as err:
+                logging.error(f'Library index refresh failed: {err}')
+            stop.wait(interval)
+
+
+library_snapshot: Optional[Snapshot] = None
+if app.config.get('LIBRARY_SNAPSHOT'):
+    library_snapshot = Snapshot(app.config['LIBRARY_SNAPSHOT'])
+
+library_index: LibraryIndex = shared('library_index', lambda: LibraryIndex(library_snapshot))
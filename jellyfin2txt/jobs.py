@@ -0,0 +1,60 @@
+import json
+import sqlite3
+from contextlib import closing, contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+
+from jellyfin2txt.utils import ExtractObject
+
+
+class JobStore:
+    """SQLite store of the extraction tasks.
+
+    Every change of the status or of the checkpoint of a task is written
+    through, so a restarted server lists the same tasks and resumes the
+    unfinished ones in the order they were requested, from their last
+    checkpoint.
+
+    :param path: The location of the SQLite database file.
+    """
+
+    schema: str = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            uuid TEXT PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock: Lock = Lock()
+        with self._connect() as db:
+            db.executescript(self.schema)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection, commit, or roll back on error, then close it."""
+        with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+            yield db
+
+    def load(self) -> list:
+        """Return the `(uuid, task)` of the stored tasks in the order they were created."""
+        with self._connect() as db:
+            rows: list = db.execute('SELECT uuid, data FROM jobs ORDER BY created_at').fetchall()
+        return [(task_uuid, ExtractObject.load(json.loads(data))) for task_uuid, data in rows]
+
+    def save(self, task_uuid: str, task: ExtractObject) -> None:
+        data: str = json.dumps(task.dump())
+        with self._lock, self._connect() as db:
+            db.execute(
+                'INSERT INTO jobs (uuid, created_at, data) VALUES (?, ?, ?)'
+                ' ON CONFLICT (uuid) DO UPDATE SET data = excluded.data',
+                (task_uuid, task.created_at, data),
+            )
+
+    def delete(self, task_uuid: str) -> None:
+        with self._lock, self._connect() as db:
+            db.execute('DELETE FROM jobs WHERE uuid = ?', (task_uuid,))
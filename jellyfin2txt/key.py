@@ -20,30 +20,47 @@ class EnhancedJSONEncoder(json.JSONEncoder):
 
 
 class KeysValidator(list):
+    """List of keys with a lookup index on the `id` and `key` fields."""
+
+    indexed_fields: tuple = ('id', 'key')
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self._index: dict = {field: {} for field in self.indexed_fields}
+        for item in self:
+            self._add_index(item)
+
+    def _add_index(self, item) -> None:
+        for field, index in self._index.items():
+            index[getattr(item, field)] = item
+
     def get(self, field, value):
+        if field in self._index:
+            return self._index[field].get(value)
         for item in self:
             if getattr(item, field) == value:
                 return item
         return None
 
     def update(self, search_field, search_value, field, value):
-        for item in self:
-            if getattr(item, search_field) == search_value:
-                setattr(item, field, value)
-                return True
-        raise ValueError('--> No value {0} found for field {1}'.format(search_value, search_field))
+        item = self.get(search_field, search_value)
+        if item is None:
+            raise ValueError('--> No value {0} found for field {1}'.format(search_value, search_field))
+        if field in self._index:
+            del self._index[field][getattr(item, field)]
+        setattr(item, field, value)
+        if field in self._index:
+            self._index[field][value] = item
+        return True
 
     def contains(self, field, value):
-        for item in self:
-            if getattr(item, field) == value:
-                return True
-        return False
+        return self.get(field, value) is not None
 
     def append(self, other, field):
-        for item in self:
-            if getattr(other, field) == getattr(item, field):
-                raise ValueError('--> Value already added: {0}'.format(other))
+        if self.contains(field, getattr(other, field)):
+            raise ValueError('--> Value already added: {0}'.format(other))
         super().append(other)
+        self._add_index(other)
 
 
 class KeyManagerException(Exception):
@@ -92,8 +109,11 @@ class KeyManager:
         return data
 
     def _write_keyfile(self) -> None:
-        with open(self.keyfile, 'w') as f:
+        # Write then rename so the server never reads a half written file.
+        tmp_keyfile = f"{self.keyfile}.tmp"
+        with open(tmp_keyfile, 'w') as f:
             json.dump(self.keys, f, ensure_ascii=False, cls=EnhancedJSONEncoder)
+        os.replace(tmp_keyfile, self.keyfile)
 
     def _gen_table(self, keys: list, headers=["id", "revoked", "comment", "key"]) -> str:
         table = []
@@ -1,43 +1,64 @@
 from typing import Optional
 
-from jellyfin2txt.config import client, params, app
+from jellyfin2txt.config import client, params, app, catalog_cache
+from jellyfin2txt.index import library_index
 
 class Media:
 
     @staticmethod
-    def _ids(params: dict, tags: list = None) -> dict:
+    def _items(params: dict, tags: list = None) -> dict:
+        """Fetch a page of items with every field needed to build a listing.
+
+        The fields are requested in the listing call itself so a page costs a
+        single round-trip to Jellyfin whatever the ``Limit`` is.
+        """
         if tags:
             params['Tags']: list = tags
-        media: dict = client.jellyfin.users('/Items', params=params)
-        items: list = []
-        for item in media['Items']:
-            items.append(item['Id'])
-        media['Items'] = items
-        return media
+        params['Fields']: str = 'RemoteTrailers,ExternalUrls'
+        key: tuple = (
+            params['IncludeItemTypes'],
+            params['ParentId'],
+            str(params['StartIndex']),
+            str(params['Limit']),
+            tuple(tags or ()),
+        )
+        return catalog_cache.get_or_set(
+            key, lambda: client.jellyfin.users('/Items', params=params)
+        )
 
     @staticmethod
-    def _movies_ids(
+    def _movies_items(
         start_index: int = 0,
-        limit: int = 100, tags:
-        list = None,
+        limit: int = 100,
+        tags: list = None,
     ) -> dict:
-        params['StartIndex']: int = start_index
-        params['Limit']: int = limit
-        params['IncludeItemTypes']: str = 'Movie'
-        params['ParentId']: str = client.movies_id
-        return Media._ids(params, tags)
+        movies_params: dict = dict(params)
+        movies_params['StartIndex']: int = start_index
+        movies_params['Limit']: int = limit
+        movies_params['IncludeItemTypes']: str = 'Movie'
+        movies_params['ParentId']: str = client.movies_id
+        return Media._items(movies_params, tags)
 
     @staticmethod
-    def _series_ids(
+    def _series_items(
         start_index: int = 0,
         limit: int = 100,
         tags: list = None,
     ) -> dict:
-        params['StartIndex']: int = start_index
-        params['Limit']: int = limit
-        params['IncludeItemTypes']: str = 'Series'
-        params['ParentId']: str = client.series_id
-        return Media._ids(params, tags)
+        series_params: dict = dict(params)
+        series_params['StartIndex']: int = start_index
+        series_params['Limit']: int = limit
+        series_params['IncludeItemTypes']: str = 'Series'
+        series_params['ParentId']: str = client.series_id
+        return Media._items(series_params, tags)
+
+    @staticmethod
+    def _imdb_link(item: dict) -> str:
+        external_link: str = ""
+        for external_url in item.get('ExternalUrls') or []:
+            if external_url['Name'] == 'IMDb':
+                external_link: str = external_url['Url']
+        return external_link
 
     @staticmethod
     def _thumbnail(
@@ -61,20 +82,19 @@ class Media:
         thumb_quality: int = 96,
         tags: str = None,
     ) -> str:
-        movies_ids: dict = Media._movies_ids(start_index, limit, tags)
+        movies: Optional[dict] = library_index.query('Movie', start_index, limit, tags)
+        if movies is None:
+            movies: dict = Media._movies_items(start_index, limit, tags)
         response: str = "{},{};".format(
-            movies_ids['StartIndex'], movies_ids['TotalRecordCount']
+            movies['StartIndex'], movies['TotalRecordCount']
         )
-        for movie_id in movies_ids['Items']:
-            movie: dict = client.jellyfin.get_item(movie_id)
+        for movie in movies['Items']:
+            movie_id: str = movie['Id']
             trailer_url: str = ""
-            if movie['RemoteTrailers']:
+            if movie.get('RemoteTrailers'):
                 trailer_url: str = movie['RemoteTrailers'][0]['Url']
             name: str = movie['Name']
-            external_link: str = ""
-            for external_url in movie['ExternalUrls']:
-                if external_url['Name'] == 'IMDb':
-                    external_link: str = external_url['Url']
+            external_link: str = Media._imdb_link(movie)
             dl_url: str = client.jellyfin.download_url(movie_id)
             stream_url: str = client.jellyfin.video_url(movie_id)
             img_url: str = Media._thumbnail(movie_id, thumb_fill_height, thumb_fill_width, thumb_quality)
@@ -91,17 +111,16 @@ class Media:
         thumb_quality: int = 96,
         tags: list = None
     ) -> str:
-        series_ids: dict = Media._series_ids(start_index, limit, tags)
+        series: Optional[dict] = library_index.query('Series', start_index, limit, tags)
+        if series is None:
+            series: dict = Media._series_items(start_index, limit, tags)
         response: str = "{},{};".format(
-            series_ids['StartIndex'], series_ids['TotalRecordCount']
+            series['StartIndex'], series['TotalRecordCount']
         )
-        for serie_id in series_ids['Items']:
-            serie: dict = client.jellyfin.get_item(serie_id)
+        for serie in series['Items']:
+            serie_id: str = serie['Id']
             name: str = serie['Name']
-            external_link: str = ""
-            for external_url in serie['ExternalUrls']:
-                if external_url['Name'] == 'IMDb':
-                    external_link: str = external_url['Url']
+            external_link: str = Media._imdb_link(serie)
             img_url: str = Media._thumbnail(serie_id, thumb_fill_height, thumb_fill_width, thumb_quality)
             variables: str = [name, img_url, serie_id, external_link, serie_id]
             response += ','.join(variables) + ';'
@@ -109,7 +128,10 @@ class Media:
 
     @staticmethod
     def seasons(serie_id: str) -> str:
-        seasons: dict = client.jellyfin.get_seasons(serie_id)
+        seasons: dict = catalog_cache.get_or_set(
+            ('Season', serie_id),
+            lambda: client.jellyfin.get_seasons(serie_id),
+        )
         response: str = "{},{};".format(
             seasons['StartIndex'], seasons['TotalRecordCount']
         )
@@ -123,7 +145,10 @@ class Media:
 
     @staticmethod
     def episodes(serie_id: str, season_id: str) -> str:
-        episodes: dict = client.jellyfin.get_season(serie_id, season_id)
+        episodes: dict = catalog_cache.get_or_set(
+            ('Episode', serie_id, season_id),
+            lambda: client.jellyfin.get_season(serie_id, season_id),
+        )
         response: str = "{},{};".format(
             episodes['StartIndex'], episodes['TotalRecordCount']
         )
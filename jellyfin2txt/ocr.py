@@ -0,0 +1,120 @@
+import hashlib
+from collections import deque
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Callable, Optional, TextIO
+
+import pytesseract
+from babelfish import Error as BabelfishError, Language
+from PIL import Image, ImageOps
+
+from jellyfin2txt.pgs import Bitmap, Cue, RawObject, decode, read_cues
+
+
+def language(code: str) -> Language:
+    """Return the babelfish language of a Jellyfin language code, english by default."""
+    try:
+        return Language.fromalpha3b(code)
+    except (BabelfishError, ValueError, KeyError):
+        return Language('eng')
+
+
+def srt_time(ms: int) -> str:
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02},{ms:03}"
+
+
+def recognize(raw: RawObject, lang: str) -> str:
+    """Decode and OCR a subtitle image, the text is turned dark on a white background.
+
+    This runs inside an OCR worker process, so it must not depend on the
+    Jellyfin client or on the Flask application.
+    """
+    bitmap: Bitmap = decode(raw)
+    image: Image.Image = Image.frombytes('L', (bitmap.width, bitmap.height), bitmap.pixels)
+    image = ImageOps.expand(ImageOps.invert(image), border=10, fill=255)
+    return pytesseract.image_to_string(image, lang=lang, config='--psm 6').strip()
+
+
+def _digest(raw: RawObject) -> bytes:
+    return hashlib.blake2b(
+        raw.width.to_bytes(2, 'big') + raw.height.to_bytes(2, 'big') + raw.palette + raw.rle,
+        digest_size=16,
+    ).digest()
+
+
+def rip(
+    track_path: str,
+    pool: Executor,
+    language_code: str = 'eng',
+    max_memory: Optional[int] = None,
+    window: int = 32,
+    resume: Optional[dict] = None,
+    checkpoint: Optional[Callable[[dict], None]] = None,
+) -> list:
+    """OCR a PGS track and return the srt files created.
+
+    The cues are read one at a time and their images are recognized in
+    parallel by the worker processes of `pool`. The results are written to
+    the srt file in the order of the cues, so at most `window` cues are
+    waiting for their text. Identical images, common for repeated lines,
+    are only recognized once. When the images waiting for the OCR go over
+    `max_memory`, the track is not read further until the OCR caught up.
+
+    :param track_path: The path of the `.sup` track, the srt file is
+        written next to it.
+    :param pool: The process pool running the OCR.
+    :param language_code: The language of the subtitles to OCR.
+    :param max_memory: The maximum number of bytes of subtitle images kept
+        by the reader of the track, then waiting for the OCR.
+    :param window: The maximum number of cues being recognized.
+    :param resume: The last checkpoint of an interrupted OCR of the track,
+        the cues already written are skipped.
+    :param checkpoint: Called every `window` cues with the checkpoint from
+        which the OCR can be resumed.
+    """
+    path: Path = Path(track_path)
+    srt_path: Path = path.with_suffix('.srt')
+    lang: str = language(language_code).alpha3
+    if lang not in pytesseract.get_languages():
+        lang = 'eng'
+    recognized: dict = {}
+    pending: deque = deque()
+    pending_size: int = 0
+    resume = resume if resume and srt_path.is_file() else {'cues': 0, 'number': 0, 'offset': 0}
+    number: int = resume['number']
+
+    def write(srt: TextIO, index: int, cue: Cue, futures: list) -> None:
+        nonlocal number, pending_size
+        pending_size -= sum(len(raw.rle) for raw in cue.objects)
+        texts: list = [future.result() for future in futures]
+        text: str = '\n'.join(text for text in texts if text)
+        if text:
+            number += 1
+            srt.write(f"{number}\n{srt_time(cue.start)} --> {srt_time(cue.end)}\n{text}\n\n")
+        if checkpoint is not None and (index + 1) % window == 0:
+            srt.flush()
+            checkpoint({'cues': index + 1, 'number': number, 'offset': srt.tell()})
+
+    with open(path, 'rb') as stream, open(srt_path, 'r+' if resume['cues'] else 'w', encoding='utf-8') as srt:
+        srt.seek(resume['offset'])
+        srt.truncate()
+        for index, cue in enumerate(read_cues(stream, max_memory)):
+            if index < resume['cues']:
+                continue
+            futures: list = []
+            for raw in cue.objects:
+                digest: bytes = _digest(raw)
+                future: Optional[Future] = recognized.get(digest)
+                if future is None:
+                    future = recognized[digest] = pool.submit(recognize, raw, lang)
+                futures.append(future)
+            pending.append((index, cue, futures))
+            pending_size += sum(len(raw.rle) for raw in cue.objects)
+            while len(pending) >= window or (max_memory is not None and pending_size > max_memory):
+                write(srt, *pending.popleft())
+        while pending:
+            write(srt, *pending.popleft())
+    return [str(srt_path)]
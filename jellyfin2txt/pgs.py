@@ -0,0 +1,183 @@
+import struct
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+PCS: int = 0x16
+WDS: int = 0x17
+PDS: int = 0x14
+ODS: int = 0x15
+END: int = 0x80
+
+EPOCH_START: int = 0x80
+
+
+class Segment(NamedTuple):
+    type: int
+    pts: int
+    data: bytes
+
+
+class Bitmap(NamedTuple):
+    """A decoded subtitle image, one byte of intensity per pixel."""
+    width: int
+    height: int
+    pixels: bytes
+
+
+class RawObject(NamedTuple):
+    """A subtitle image still run-length encoded, with its palette intensities."""
+    width: int
+    height: int
+    rle: bytes
+    palette: bytes
+
+
+class Cue(NamedTuple):
+    """The subtitle images displayed together with their display time in milliseconds."""
+    start: int
+    end: int
+    objects: list
+
+
+def read_segments(stream: BinaryIO) -> Iterator[Segment]:
+    """Read the segments of a `.sup` stream one at a time."""
+    while True:
+        header: bytes = stream.read(13)
+        if len(header) < 13:
+            return
+        magic, pts, _, segment_type, size = struct.unpack('>2sIIBH', header)
+        if magic != b'PG':
+            raise ValueError('Invalid PGS segment')
+        yield Segment(segment_type, pts // 90, stream.read(size))
+
+
+def decode_rle(data: bytes, width: int, height: int) -> bytearray:
+    """Decode the run-length encoded palette indexes of an object."""
+    pixels: bytearray = bytearray(width * height)
+    position: int = 0
+    line: int = 0
+    index: int = 0
+    size: int = len(data)
+    try:
+        while index < size and line < height:
+            byte: int = data[index]
+            index += 1
+            if byte:
+                if position < width:
+                    pixels[line * width + position] = byte
+                position += 1
+                continue
+            flag: int = data[index]
+            index += 1
+            if flag == 0:
+                line += 1
+                position = 0
+                continue
+            length: int = flag & 0x3f
+            if flag & 0x40:
+                length = (length << 8) | data[index]
+                index += 1
+            color: int = 0
+            if flag & 0x80:
+                color = data[index]
+                index += 1
+            if color:
+                start: int = line * width + position
+                end: int = line * width + min(position + length, width)
+                pixels[start:end] = bytes([color]) * (end - start)
+            position += length
+    except IndexError:
+        # Truncated data, keep the lines decoded so far.
+        pass
+    return pixels
+
+
+def decode(raw: RawObject) -> Bitmap:
+    indexes: bytearray = decode_rle(raw.rle, raw.width, raw.height)
+    return Bitmap(raw.width, raw.height, bytes(indexes.translate(raw.palette)))
+
+
+def palette_intensity(data: bytes) -> bytes:
+    """Map each palette index to a grey level, the opaque bright pixels being the text."""
+    intensity: bytearray = bytearray(256)
+    for offset in range(2, len(data) - 4, 5):
+        entry, luma, _, _, alpha = data[offset:offset + 5]
+        intensity[entry] = luma * alpha // 255
+    return bytes(intensity)
+
+
+def _composition_ids(data: bytes) -> list:
+    """Return the ids of the objects displayed by a presentation composition."""
+    ids: list = []
+    offset: int = 11
+    for _ in range(data[10]):
+        ids.append(struct.unpack_from('>H', data, offset)[0])
+        offset += 16 if data[offset + 3] & 0x40 else 8
+    return ids
+
+
+def read_cues(stream: BinaryIO, max_memory: Optional[int] = None) -> Iterator[Cue]:
+    """Read the display sets of a `.sup` stream and yield the cues in order.
+
+    Only the display set being read and the objects of the current epoch
+    are kept in memory, whatever the size of the stream. The images are
+    left encoded, see :py:func:`decode`.
+
+    :param max_memory: The maximum number of bytes of object data buffered.
+    :raises ValueError: When the objects of an epoch go over `max_memory`,
+        as none of them can be dropped without losing subtitles.
+    """
+    palette: bytes = bytes(256)
+    objects: dict = {}
+    buffered: int = 0
+    composition: list = []
+    pending: Optional[tuple] = None
+    palette_update: bool = False
+    pts: int = 0
+    for segment in read_segments(stream):
+        if segment.type == PCS:
+            pts = segment.pts
+            state: int = segment.data[7]
+            if state & EPOCH_START:
+                objects.clear()
+                buffered = 0
+            palette_update: bool = bool(segment.data[8] & 0x80)
+            composition = _composition_ids(segment.data)
+        elif segment.type == PDS:
+            palette = palette_intensity(segment.data)
+        elif segment.type == ODS:
+            object_id: int = struct.unpack_from('>H', segment.data, 0)[0]
+            flags: int = segment.data[3]
+            if flags & 0x80:
+                length: int = int.from_bytes(segment.data[4:7], 'big') - 4
+                width, height = struct.unpack_from('>HH', segment.data, 7)
+                # The object redefined is replaced, its data is not buffered anymore.
+                replaced: Optional[list] = objects.pop(object_id, None)
+                if replaced is not None:
+                    buffered -= len(replaced[2])
+                if max_memory is not None and buffered + length > max_memory:
+                    raise ValueError(
+                        f'The subtitle images at {pts} ms need more than {max_memory} bytes, '
+                        'raise OCR_MAX_MEMORY'
+                    )
+                buffered += len(segment.data) - 11
+                objects[object_id] = [width, height, bytearray(segment.data[11:])]
+            elif object_id in objects:
+                buffered += len(segment.data) - 4
+                objects[object_id][2].extend(segment.data[4:])
+        elif segment.type == END:
+            if palette_update and pending is not None:
+                # Only the colors changed, e.g. a fade, the text stays the same.
+                continue
+            if pending is not None:
+                yield Cue(pending[0], pts, pending[1])
+                pending = None
+            raw_objects: list = []
+            for object_id in composition:
+                if object_id not in objects:
+                    continue
+                width, height, rle = objects[object_id]
+                raw_objects.append(RawObject(width, height, bytes(rle), palette))
+            if raw_objects:
+                pending = (pts, raw_objects)
+    if pending is not None:
+        yield Cue(pending[0], pending[0] + 5000, pending[1])
@@ -0,0 +1,271 @@
+import shutil
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock, Semaphore, Thread
+from time import time
+from typing import Optional
+
+from jellyfin2txt.config import app, extract_queue, extract_tasks
+from jellyfin2txt.fairqueue import FairQueue
+from jellyfin2txt.ocr import language, rip
+from jellyfin2txt.shared import shared
+from jellyfin2txt.subtitle import Subtitle
+from jellyfin2txt.store import subtitle_store
+from jellyfin2txt.utils import ExtractObject, DownloadInterrupted, process_pool
+
+
+class ExtractScheduler:
+    """Run the extraction jobs queued in `extract_queue`.
+
+    A dispatcher thread sorts the jobs by kind. The text subtitles, only
+    downloaded and converted in srt, are run by a small pool of threads so
+    they never wait behind the PGS subtitles, and the searches of the
+    subtitle providers by another one. A PGS job goes through two stages with their own concurrency limits:
+    the download of the subtitle track, or of the whole media when ffmpeg
+    is not available, done by threads since it is network bound,
+    then the OCR, where the images of the tracks are recognized in
+    parallel by a pool of processes since it is CPU bound. A track is
+    downloaded while others are being OCR'd. The OCR streams the track so
+    its memory usage is bounded by `OCR_MAX_MEMORY`.
+
+    The number of downloaded media waiting for or being OCR'd is bounded,
+    so the downloads do not fill the temporary folder.
+
+    The PGS jobs are shared between the auth keys that requested them: the
+    keys take turns and each one has at most `EXTRACT_KEY_MAX_JOBS` jobs
+    downloading or being OCR'd, so a key queueing a whole season does not
+    delay a single movie requested with another key. A job which track is
+    already downloaded goes first, it only waits for the OCR.
+
+    The threads block on their queue until a job or the shutdown
+    signal arrives. On shutdown the downloads stop at the next chunk and
+    keep their partial file in the job folder to be resumed, and the images
+    not recognized yet are cancelled. When the tasks are persisted, the
+    unfinished ones are queued again on start: a track already downloaded
+    is not downloaded again and the OCR restarts from its last checkpoint.
+    """
+
+    def __init__(self) -> None:
+        self.download_workers: int = app.config.get('EXTRACT_DOWNLOAD_WORKERS', 1)
+        self.download_queue: FairQueue = FairQueue(app.config.get('EXTRACT_KEY_MAX_JOBS', 2))
+        self.convert_pool: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=app.config.get('EXTRACT_CONVERT_WORKERS', 2)
+        )
+        self.discover_pool: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=app.config.get('EXTRACT_DISCOVER_WORKERS', 2)
+        )
+        self.dispatcher: Optional[Thread] = None
+        self.ocr_workers: int = app.config.get('EXTRACT_OCR_WORKERS', 1)
+        self.ocr_slots: Semaphore = Semaphore(self.ocr_workers + self.download_workers)
+        self.ocr_pool: ProcessPoolExecutor = process_pool(self.ocr_workers)
+        self.track_only: bool = app.config.get('EXTRACT_MODE', 'track') == 'track'
+        if self.track_only and shutil.which('ffmpeg') is None:
+            logging.warning('ffmpeg not found, the PGS subtitles will be extracted from the full media')
+            self.track_only = False
+        self.ocr_max_memory: int = app.config.get('OCR_MAX_MEMORY', 256) * 1024 * 1024
+        self.stopping: Event = Event()
+        self.threads: list = []
+        self._metrics_lock: Lock = Lock()
+        self.converting: int = 0
+        self.downloading: int = 0
+        self.ocr_pending: int = 0
+        self.started: int = 0
+        self.total_wait: int = 0
+        self.max_wait: int = 0
+
+    def start(self) -> None:
+        for task_uuid in extract_tasks.load():
+            logging.info(f"Resuming the extraction of {extract_tasks[task_uuid].srt_name}")
+            extract_queue.put(task_uuid)
+        self.dispatcher = Thread(target=self.dispatch_thread, daemon=True)
+        self.dispatcher.start()
+        for _ in range(self.download_workers):
+            thread: Thread = Thread(target=self.download_thread, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def shutdown(self) -> None:
+        logging.info("Stopping the extraction scheduler...")
+        self.stopping.set()
+        extract_queue.put(None)
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        for _ in self.threads:
+            self.download_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.convert_pool.shutdown(wait=True, cancel_futures=True)
+        self.discover_pool.shutdown(wait=True, cancel_futures=True)
+        self.ocr_pool.shutdown(wait=True, cancel_futures=True)
+
+    def metrics(self) -> str:
+        """Return `queue_depth,downloading,ocr_pending,started,avg_wait,max_wait,converting`.
+
+        The queue depth counts the jobs not started yet. The wait is the time
+        in milliseconds a job spent in the queue before it started.
+        """
+        with self._metrics_lock:
+            avg_wait: int = self.total_wait // self.started if self.started else 0
+            queue_depth: int = extract_queue.qsize() + self.download_queue.qsize()
+            return (
+                f"{queue_depth},{self.downloading},{self.ocr_pending},"
+                f"{self.started},{avg_wait},{self.max_wait},{self.converting}"
+            )
+
+    def _count(self, field: str, value: int) -> None:
+        with self._metrics_lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    @staticmethod
+    def _error(task: ExtractObject, msg: str) -> None:
+        task.update("status", "error")
+        task.update("error_message", msg)
+        logging.error(msg)
+
+    def _start(self, task: ExtractObject) -> None:
+        wait: int = int(time() * 1000) - task.created_at
+        with self._metrics_lock:
+            self.started += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        task.update("status", "in progress")
+
+    def dispatch_thread(self) -> None:
+        while True:
+            task_uuid: str = extract_queue.get()
+            if task_uuid is None or self.stopping.is_set():
+                return
+            task: ExtractObject = extract_tasks[task_uuid]
+            if task.kind == 'convert':
+                self.convert_pool.submit(self._convert, task_uuid)
+            elif task.kind == 'discover':
+                self.discover_pool.submit(self._discover, task_uuid)
+            else:
+                self.download_queue.put(task_uuid, task.owner, 0 if task.checkpoint else 1)
+
+    def _convert(self, task_uuid: str) -> None:
+        task: ExtractObject = extract_tasks[task_uuid]
+        self._start(task)
+        self._count('converting', 1)
+        try:
+            Subtitle.convert(task)
+            task.update("status", "done")
+        except Exception as err:
+            self._error(task, f"Conversion failed: {err}")
+        finally:
+            self._count('converting', -1)
+
+    def _discover(self, task_uuid: str) -> None:
+        task: ExtractObject = extract_tasks[task_uuid]
+        self._start(task)
+        try:
+            Subtitle.discover(task)
+            task.update("status", "done")
+        except Exception as err:
+            self._error(task, f"Discovery failed: {err}")
+
+    def download_thread(self) -> None:
+        while True:
+            task_uuid: str = self.download_queue.get()
+            if task_uuid is None or self.stopping.is_set():
+                return
+            task: ExtractObject = extract_tasks[task_uuid]
+            # Waits for an OCR slot without missing the shutdown.
+            while not self.ocr_slots.acquire(timeout=1):
+                if self.stopping.is_set():
+                    self.download_queue.done(task.owner)
+                    return
+            self._count('downloading', 1)
+            try:
+                submitted: bool = self._download(task_uuid)
+            except DownloadInterrupted as err:
+                task.update("status", "interrupted")
+                logging.warning(err)
+                submitted: bool = False
+            except Exception as err:
+                self._error(task, f"Download failed: {err}")
+                shutil.rmtree(self._workdir(task), ignore_errors=True)
+                submitted: bool = False
+            finally:
+                self._count('downloading', -1)
+            if not submitted:
+                self._release(task)
+
+    def _release(self, task: ExtractObject) -> None:
+        self.ocr_slots.release()
+        self.download_queue.done(task.owner)
+
+    @staticmethod
+    def _workdir(task: ExtractObject) -> Path:
+        """Return the folder of the files of a job, shared by the jobs of the
+        same track so a job submitted again resumes the download."""
+        return Subtitle.tmp_subtitles_output_folder / f"{task.item_id}.{task.stream_index}"
+
+    def _download(self, task_uuid: str) -> bool:
+        task: ExtractObject = extract_tasks[task_uuid]
+        self._start(task)
+        workdir: Path = self._workdir(task)
+        workdir.mkdir(parents=True, exist_ok=True)
+        language_code: str = task.language or 'eng'
+        track_path: Path = workdir / f"{Path(task.item_name).stem}.{language(language_code)}.sup"
+        if track_path.is_file():
+            logging.info(f"Track of {task.item_name} already downloaded, resuming")
+        elif self.track_only:
+            Subtitle.download_track(task.item_id, task.stream_index, track_path, self.stopping, task.progress)
+        else:
+            try:
+                from sh import mkvextract
+            except ImportError:
+                self._error(task, "Cannot extract subtitles if mkvextract is not available.")
+                shutil.rmtree(workdir, ignore_errors=True)
+                return False
+            media_dl_path: Path = workdir / Path(task.item_name)
+            Subtitle.download(task.item_id, media_dl_path, self.stopping, task.progress)
+            mkvextract('tracks', str(media_dl_path), f"{task.stream_index}:{track_path}")
+            media_dl_path.unlink()
+        file_key: str = subtitle_store.file_key(track_path)
+        cached: Optional[str] = subtitle_store.lookup_content(file_key)
+        if cached is not None:
+            logging.info(f"Track of {task.item_name} already OCR'd in {cached}")
+            subtitle_store.alias(cached, task.srt_name.name, task.item_id)
+            subtitle_store.add_content([task.content_key], cached)
+            task.update("status", "done")
+            shutil.rmtree(workdir, ignore_errors=True)
+            return False
+        logging.info(f"Processing the media {task.item_name}...")
+        self._count('ocr_pending', 1)
+        Thread(
+            target=self._ocr, args=(task_uuid, track_path, language_code, file_key), daemon=True
+        ).start()
+        return True
+
+    def _ocr(self, task_uuid: str, track_path: Path, language_code: str, file_key: str) -> None:
+        task: ExtractObject = extract_tasks[task_uuid]
+        try:
+            srt_files: list = rip(
+                str(track_path), self.ocr_pool, language_code,
+                self.ocr_max_memory, self.ocr_workers * 4,
+                resume=task.checkpoint,
+                checkpoint=lambda checkpoint: task.update("checkpoint", checkpoint),
+            )
+            for entry in srt_files:
+                Subtitle.clean_sub(Path(entry))
+                Subtitle.publish(Path(entry), task.srt_name, task.item_id)
+            subtitle_store.add_content([task.content_key, file_key], task.srt_name.name)
+            task.update("status", "done")
+            logging.info("Cleaning downloaded file...")
+            shutil.rmtree(self._workdir(task), ignore_errors=True)
+        except Exception as err:
+            if self.stopping.is_set():
+                # The pool was shut down, keep the downloaded track to resume the job.
+                task.update("status", "interrupted")
+            else:
+                self._error(task, f"Extraction failed: {err}")
+                shutil.rmtree(self._workdir(task), ignore_errors=True)
+        finally:
+            self._count('ocr_pending', -1)
+            self._release(task)
+
+
+extract_scheduler: ExtractScheduler = shared('extract_scheduler', ExtractScheduler)
@@ -0,0 +1,98 @@
+import os
+from multiprocessing.managers import BaseManager, BaseProxy, public_methods
+from pathlib import Path
+from threading import Thread
+from typing import Any, Callable, Optional
+
+from jellyfin2txt.cache import TTLCache
+
+ADDRESS_ENV: str = 'JELLYFIN2TXT_SHARED'
+AUTHKEY_ENV: str = 'JELLYFIN2TXT_SHARED_KEY'
+
+# Set in the worker processes of the production server, see jellyfin2txt.app.serve.
+worker: bool = ADDRESS_ENV in os.environ
+
+
+class SharedManager(BaseManager):
+    """Serve the objects of the main process to the workers of the production server."""
+
+
+class CacheProxy(BaseProxy):
+    """Proxy of a :py:class:`jellyfin2txt.cache.TTLCache`, the missing values
+    are computed by the worker then stored in the shared cache."""
+
+    _exposed_: tuple = ('get', 'set', 'pop', 'clear', '__repr__')
+
+    def get(self, key, default: Any = None) -> Any:
+        return self._callmethod('get', (key, default))
+
+    def set(self, key, value: Any) -> None:
+        return self._callmethod('set', (key, value))
+
+    def pop(self, key) -> None:
+        return self._callmethod('pop', (key,))
+
+    def clear(self) -> int:
+        return self._callmethod('clear')
+
+    get_or_set = TTLCache.get_or_set
+
+    def __repr__(self) -> str:
+        return self._callmethod('__repr__')
+
+
+# The dunder methods used on the shared objects, only exposed when defined.
+exposed_dunders: tuple = ('__contains__', '__getitem__', '__setitem__')
+
+_objects: dict = {}
+_manager: Optional[SharedManager] = None
+
+
+def shared(name: str, factory: Callable[[], Any], proxytype: type = None) -> Any:
+    """Return the object `name` shared by the main process.
+
+    In the main process the object is made by `factory` and served to the
+    workers by :py:func:`serve`. In a worker of the production server, the
+    proxy of the object of the main process is returned instead, so every
+    worker sees the same tasks, caches and subtitles.
+
+    :param name: The name of the object.
+    :param factory: The function making the object.
+    :param proxytype: The proxy class of the object, its public methods are
+        proxied by default.
+    """
+    global _manager
+    if not worker:
+        obj: Any = factory()
+        _objects[name] = (obj, proxytype)
+        return obj
+    SharedManager.register(name, proxytype=proxytype)
+    if _manager is None:
+        _manager = SharedManager(
+            address=os.environ[ADDRESS_ENV], authkey=bytes.fromhex(os.environ[AUTHKEY_ENV])
+        )
+        _manager.connect()
+    return getattr(_manager, name)()
+
+
+def serve(address: Path) -> dict:
+    """Serve the shared objects on the unix socket `address`.
+
+    :returns: The environment variables connecting a worker to the objects.
+    """
+    for name, (obj, proxytype) in _objects.items():
+        exposed: Optional[tuple] = getattr(proxytype, '_exposed_', None)
+        if exposed is None:
+            exposed = tuple(public_methods(obj)) + tuple(
+                method for method in exposed_dunders if hasattr(obj, method)
+            )
+        SharedManager.register(
+            name, callable=lambda obj=obj: obj, proxytype=proxytype, exposed=exposed
+        )
+    address = Path(address)
+    address.parent.mkdir(parents=True, exist_ok=True)
+    address.unlink(missing_ok=True)
+    authkey: bytes = os.urandom(32)
+    server = SharedManager(address=str(address), authkey=authkey).get_server()
+    Thread(target=server.serve_forever, daemon=True).start()
+    return {ADDRESS_ENV: str(address), AUTHKEY_ENV: authkey.hex()}
@@ -0,0 +1,96 @@
+import json
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, Optional
+
+
+class Snapshot:
+    """SQLite snapshot of the library index and of the media folders.
+
+    It lets a restarted server answer the listings immediately while the
+    background refresh reconciles the index with Jellyfin.
+
+    :param path: The location of the SQLite database file.
+    """
+
+    schema: str = """
+        CREATE TABLE IF NOT EXISTS catalog (
+            item_type TEXT NOT NULL,
+            parent_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (item_type, id)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock: Lock = Lock()
+        with self._connect() as db:
+            db.executescript(self.schema)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection, commit, or roll back on error, then close it."""
+        with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+            yield db
+
+    def _get_meta(self, db: sqlite3.Connection, key: str) -> Optional[str]:
+        row: tuple = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, db: sqlite3.Connection, key: str, value: str) -> None:
+        db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def load_media_folders(self) -> dict:
+        with self._connect() as db:
+            value: Optional[str] = self._get_meta(db, 'media_folders')
+        return json.loads(value) if value else {}
+
+    def save_media_folders(self, media_folders: dict) -> None:
+        with self._lock, self._connect() as db:
+            self._set_meta(db, 'media_folders', json.dumps(media_folders))
+
+    def load_catalog(self, item_type: str, parent_id: str) -> list:
+        with self._connect() as db:
+            rows: list = db.execute(
+                'SELECT data FROM catalog WHERE item_type = ? AND parent_id = ?',
+                (item_type, parent_id),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def load_parent_ids(self) -> dict:
+        """Return the ids of the library folders of the stored catalogs by item type."""
+        with self._connect() as db:
+            value: Optional[str] = self._get_meta(db, 'parent_ids')
+        return json.loads(value) if value else {}
+
+    def load_last_refresh(self) -> Optional[datetime]:
+        with self._connect() as db:
+            value: Optional[str] = self._get_meta(db, 'last_refresh')
+        return datetime.fromisoformat(value) if value else None
+
+    def save_catalogs(self, catalogs: list, last_refresh: datetime) -> None:
+        """Replace the stored catalogs in one transaction, with the ids of their library folders."""
+        with self._lock, self._connect() as db:
+            for catalog in catalogs:
+                db.execute('DELETE FROM catalog WHERE item_type = ?', (catalog.item_type,))
+                db.executemany(
+                    'INSERT INTO catalog (item_type, parent_id, id, data) VALUES (?, ?, ?, ?)',
+                    [
+                        (catalog.item_type, catalog.parent_id, item_id, json.dumps(item))
+                        for item_id, item in catalog.items.items()
+                    ],
+                )
+            self._set_meta(db, 'parent_ids', json.dumps(
+                {catalog.item_type: catalog.parent_id for catalog in catalogs}
+            ))
+            self._set_meta(db, 'last_refresh', last_refresh.isoformat())
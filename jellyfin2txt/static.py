@@ -0,0 +1,113 @@
+import os
+import gzip
+import hashlib
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from flask import Response, request, send_file
+
+from jellyfin2txt.config import app
+from jellyfin2txt.store import subtitle_store
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StaticSubtitles:
+    """Serve the subtitles of the store over HTTP.
+
+    Each file is served with a strong ETag, the hash of its content, so a
+    client sending it back in `If-None-Match` gets a 304 without the file,
+    and with the `Range` requests handled by :py:func:`flask.send_file`,
+    which lets the WSGI server send the file with `sendfile` when it can.
+    The files are compressed in gzip, or brotli when the `brotli` package
+    is installed, once per content in `folder`, then served compressed to
+    the clients accepting it.
+
+    :param folder: The folder of the compressed files.
+    :param min_size: The size in bytes under which a file is never compressed.
+    :param max_age: The time in seconds a client can keep a file without
+        checking it again.
+    """
+
+    extensions: dict = {'br': 'br', 'gzip': 'gz'}
+
+    def __init__(self, folder: Path, min_size: int = 1024, max_age: int = 0) -> None:
+        self.folder: Path = Path(folder)
+        self.min_size: int = min_size
+        self.max_age: int = max_age
+        self.encodings: list = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self.digests: dict = {}
+        self._lock: Lock = Lock()
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def digest(self, path: Path) -> (str, os.stat_result):
+        """Return the hash of a file, computed again only when it changed."""
+        stat: os.stat_result = path.stat()
+        version: tuple = (stat.st_mtime_ns, stat.st_size)
+        cached: Optional[tuple] = self.digests.get(path.name)
+        if cached is not None and cached[0] == version:
+            return cached[1], stat
+        with open(path, 'rb') as file:
+            digest: str = hashlib.file_digest(file, 'sha256').hexdigest()
+        with self._lock:
+            self.digests[path.name] = (version, digest)
+        return digest, stat
+
+    def compressed(self, path: Path, digest: str, encoding: str) -> Path:
+        """Return the file of `path` compressed with `encoding`, compressing it if needed."""
+        compressed: Path = self.folder / f"{digest}.{self.extensions[encoding]}"
+        if compressed.is_file():
+            return compressed
+        data: bytes = path.read_bytes()
+        if encoding == 'br':
+            data = brotli.compress(data, mode=brotli.MODE_TEXT)
+        else:
+            data = gzip.compress(data, compresslevel=9, mtime=0)
+        tmp_path: Path = compressed.with_name(f".{compressed.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, compressed)
+        return compressed
+
+    def response(self, name: str) -> Response:
+        path: Optional[Path] = subtitle_store.get(name)
+        if path is None:
+            return "Subtitle not found", 404
+        try:
+            digest, stat = self.digest(path)
+        except FileNotFoundError:
+            subtitle_store.remove(name)
+            return "Subtitle not found", 404
+        encoding: Optional[str] = None
+        # The ranges are only served on the file itself, not on its compressed
+        # version, as few clients handle ranges of an encoded content.
+        if stat.st_size >= self.min_size and 'Range' not in request.headers:
+            encoding = request.accept_encodings.best_match(self.encodings)
+        file: Path = path
+        etag: str = digest
+        if encoding is not None:
+            try:
+                file = self.compressed(path, digest, encoding)
+                etag = f"{digest}-{self.extensions[encoding]}"
+            except OSError as err:
+                logging.warning(f"Cannot compress {name}: {err}")
+                encoding = None
+        response: Response = send_file(
+            file, mimetype='text/plain', download_name=name, conditional=True,
+            etag=etag, last_modified=stat.st_mtime, max_age=self.max_age,
+        )
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+static_subtitles: StaticSubtitles = StaticSubtitles(
+    app.config.get('SERVE_COMPRESSED', '/tmp/jellyfin2txt/compressed'),
+    min_size=app.config.get('SERVE_MIN_COMPRESS_SIZE', 1024),
+    max_age=app.config.get('SERVE_MAX_AGE', 0),
+)
@@ -0,0 +1,277 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from threading import Event, Lock, Timer
+from typing import Optional
+
+from guessit import guessit
+
+from jellyfin2txt.config import app
+from jellyfin2txt.shared import shared
+
+
+@lru_cache(maxsize=1024)
+def guess(name: str) -> tuple:
+    """Return the `(title, year, subtitle_language)` guessed from a file name."""
+    guessed: dict = guessit(name)
+    lang = guessed.get('subtitle_language', '')
+    lang = getattr(lang, 'name', lang)
+    return (str(guessed.get('title', '')), guessed.get('year'), str(lang))
+
+
+class SubtitleStore:
+    """Index of the subtitles available in the output folder.
+
+    The folder is listed once at startup, then every path writing a subtitle
+    registers it so lookups never list the folder. A background watcher
+    rescans the folder only when its modification time changed, to pick up
+    files added or removed by hand.
+
+    The guessit metadata of each file is computed once, persisted in a
+    metadata file inside the folder, and indexed by title and year. The
+    metadata of the subtitles added are written together `save_delay`
+    seconds after the first one.
+
+    The subtitles are also addressed by the content they were made from,
+    the Jellyfin media source and stream index or the hash of the source
+    subtitle, so a track already converted or OCR'd for an item is only
+    aliased under the name expected for another item.
+
+    :param folder: The folder holding the subtitles served by the proxy.
+    """
+
+    save_delay: float = 2
+
+    def __init__(self, folder: Path) -> None:
+        self.folder: Path = Path(folder)
+        self.metadata_file: Path = self.folder / '.jellyfin2txt-metadata.json'
+        self.content_file: Path = self.folder / '.jellyfin2txt-content.json'
+        self.content: dict = {}
+        self.files: dict = {}
+        self.items: dict = {}
+        self.metadata: dict = {}
+        self.titles: dict = {}
+        self._folder_mtime: Optional[int] = None
+        self._lock: Lock = Lock()
+        self._save_lock: Lock = Lock()
+        self._metadata_timer: Optional[Timer] = None
+
+    def _index_title(self, name: str, metadata: tuple) -> None:
+        title, year, _ = metadata
+        if year is not None:
+            self.titles.setdefault((title, year), set()).add(name)
+
+    def _set_metadata(self, name: str) -> None:
+        metadata: tuple = guess(name)
+        with self._lock:
+            self.metadata[name] = metadata
+            self._index_title(name, metadata)
+
+    def load_metadata(self) -> None:
+        if not self.metadata_file.is_file():
+            return
+        try:
+            with open(self.metadata_file, 'r') as file:
+                metadata: dict = json.load(file)
+        except json.decoder.JSONDecodeError:
+            logging.warning(f'Ignoring corrupted metadata file {self.metadata_file}')
+            return
+        with self._lock:
+            for name, (title, year, lang) in metadata.items():
+                self.metadata[name] = (title, year, lang)
+                self._index_title(name, self.metadata[name])
+
+    def _write_json(self, path: Path, data: dict) -> None:
+        """Replace `path` with `data`, the caller holds `_save_lock`."""
+        with tempfile.NamedTemporaryFile(
+            'w', dir=self.folder, prefix=f".{path.name}.", suffix='.tmp', delete=False
+        ) as file:
+            json.dump(data, file, ensure_ascii=False)
+        try:
+            os.replace(file.name, path)
+        except OSError:
+            os.unlink(file.name)
+            raise
+
+    def save_metadata(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                metadata: dict = dict(self.metadata)
+            self._write_json(self.metadata_file, metadata)
+
+    def _schedule_save_metadata(self) -> None:
+        with self._lock:
+            if self._metadata_timer is not None:
+                return
+            self._metadata_timer = Timer(self.save_delay, self.flush_metadata)
+            self._metadata_timer.daemon = True
+            self._metadata_timer.start()
+
+    def flush_metadata(self) -> None:
+        """Write the metadata of the subtitles added since the last save."""
+        with self._lock:
+            timer: Optional[Timer] = self._metadata_timer
+            self._metadata_timer = None
+        if timer is None:
+            return
+        timer.cancel()
+        try:
+            self.save_metadata()
+        except OSError as err:
+            logging.error(f'Cannot save the metadata file {self.metadata_file}: {err}')
+
+    def load_content(self) -> None:
+        if not self.content_file.is_file():
+            return
+        try:
+            with open(self.content_file, 'r') as file:
+                content: dict = json.load(file)
+        except json.decoder.JSONDecodeError:
+            logging.warning(f'Ignoring corrupted content file {self.content_file}')
+            return
+        with self._lock:
+            self.content.update(content)
+
+    def save_content(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                content: dict = dict(self.content)
+            self._write_json(self.content_file, content)
+
+    @staticmethod
+    def stream_key(source: dict, stream_index: int) -> str:
+        """Return the content key of a stream of a media source.
+
+        The key holds the ETag and the size of the source, so the subtitles
+        of a media file replaced under the same id are made again.
+        """
+        version: str = f"{source.get('ETag') or ''}:{source.get('Size') or ''}"
+        return f"stream:{source['Id']}:{version}:{stream_index}"
+
+    @staticmethod
+    def digest_key(digest) -> str:
+        """Return the content key of a file from its sha256 hash object."""
+        return f"sha256:{digest.hexdigest()}"
+
+    @staticmethod
+    def file_key(path: Path) -> str:
+        with open(path, 'rb') as file:
+            return SubtitleStore.digest_key(hashlib.file_digest(file, 'sha256'))
+
+    def lookup_content(self, key: Optional[str]) -> Optional[str]:
+        """Return the name of the subtitle made from `key` if it still exists."""
+        name: Optional[str] = self.content.get(key)
+        if name is not None and name in self.files:
+            return name
+        return None
+
+    def add_content(self, keys: list, name: str) -> None:
+        with self._lock:
+            for key in keys:
+                if key is not None:
+                    self.content[key] = name
+        self.save_content()
+
+    def alias(self, name: str, alias: str, item_id: Optional[str] = None) -> Path:
+        """Make the subtitle `name` available under the name `alias` too."""
+        destination: Path = self.folder / alias
+        if alias != name:
+            tmp_destination: Path = destination.with_name(f".{alias}.tmp")
+            try:
+                os.link(self.folder / name, tmp_destination)
+            except OSError:
+                shutil.copyfile(self.folder / name, tmp_destination)
+            os.replace(tmp_destination, destination)
+        self.add(destination, item_id)
+        return destination
+
+    def index_metadata(self) -> None:
+        """Guess the metadata of the files not known yet and persist them."""
+        missing: list = [name for name in self.files if name not in self.metadata]
+        if not missing:
+            return
+        logging.info(f'Guessing the metadata of {len(missing)} subtitles...')
+        for name in missing:
+            self._set_metadata(name)
+        self.save_metadata()
+
+    def scan(self) -> None:
+        try:
+            mtime: int = self.folder.stat().st_mtime_ns
+        except FileNotFoundError:
+            logging.warning(f'Subtitles folder {self.folder} does not exist')
+            return
+        if mtime == self._folder_mtime:
+            return
+        files: dict = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.srt'):
+                    files[entry.name] = self.folder / entry.name
+        with self._lock:
+            self.files = files
+            self._folder_mtime = mtime
+            for names in self.items.values():
+                names.intersection_update(files)
+            for name in set(self.metadata) - set(files):
+                self._remove_metadata(name)
+
+    def _remove_metadata(self, name: str) -> None:
+        metadata: Optional[tuple] = self.metadata.pop(name, None)
+        if metadata is not None:
+            self.titles.get(metadata[:2], set()).discard(name)
+
+    def add(self, path: Path, item_id: Optional[str] = None) -> None:
+        path = Path(path)
+        with self._lock:
+            self.files[path.name] = path
+            if item_id is not None:
+                self.items.setdefault(item_id, set()).add(path.name)
+        self._set_metadata(path.name)
+        self._schedule_save_metadata()
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self.files.pop(name, None)
+            for names in self.items.values():
+                names.discard(name)
+            self._remove_metadata(name)
+
+    def get(self, name: str) -> Optional[Path]:
+        return self.files.get(name)
+
+    def match(self, media_name: str) -> list:
+        """Return the `(file name, language)` of the subtitles matching a media.
+
+        A subtitle matches when guessit finds the same title and year in its
+        name as in the media file name.
+        """
+        title, year, _ = guess(media_name)
+        if year is None:
+            logging.warning(f"The media '{media_name}' doesn't have enough information for match")
+            return []
+        with self._lock:
+            names: list = sorted(self.titles.get((title, year), ()))
+            return [(name, self.metadata[name][2]) for name in names if name in self.files]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def watch_thread(self, stop: Event) -> None:
+        interval: int = app.config.get('SUBTITLES_RESCAN', 60)
+        while True:
+            try:
+                self.scan()
+                self.index_metadata()
+            except OSError as err:
+                logging.error(f'Subtitles folder scan failed: {err}')
+            if stop.wait(interval):
+                return
+
+
+subtitle_store: SubtitleStore = shared('subtitle_store', lambda: SubtitleStore(app.config['SUBTITLES_OUTPUT']))
@@ -1,27 +1,25 @@
 import os
 import urllib
-import psutil
-import uuid
-from urllib.request import urlopen
-from http.client import HTTPResponse
-from functools import partial
+import hashlib
+import subprocess
 from pathlib import Path
-from cleanit import Config as cleanitConfig
-from cleanit import Subtitle as cleanitSubtitle
-from pyasstosrt import Subtitle as pyasstosrtSubtitle
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, IO, Optional
 import tempfile
-from jellyfin2txt.utils import sizeof_fmt
-from pgsrip import pgsrip, Mkv, Options
-from guessit import guessit
-
-from subliminal import Video, download_best_subtitles, save_subtitles
+from itertools import chain
 
 import logging
 
 from  jellyfin_apiclient_python.exceptions import HTTPException as jellyfin_apiclient_python_HTTPException
 
-from jellyfin2txt.config import client, app, extract_queue, extract_tasks
-from jellyfin2txt.utils import ExtractObject
+from jellyfin2txt.config import client, app, extract_queue, extract_tasks, play_info_cache
+from jellyfin2txt.utils import ExtractObject, DownloadInterrupted, sizeof_fmt, subtitle_url, open_text
+from jellyfin2txt.store import subtitle_store
+from jellyfin2txt.discover import subtitle_discoverer
+from jellyfin2txt.cleaner import subtitle_cleaner
+from jellyfin2txt.downloader import Downloader
+from jellyfin2txt import ass
 
 class Subtitle:
     subtitles_output_folder: Path = Path(app.config['SUBTITLES_OUTPUT'])
@@ -59,25 +57,42 @@ class Subtitle:
             }
         ]
     }
+    downloader: Downloader = Downloader(
+        buffer_size=app.config.get('DOWNLOAD_BUFFER_SIZE', 1024 * 1024),
+        connections=app.config.get('DOWNLOAD_CONNECTIONS', 1),
+        progress_interval=app.config.get('DOWNLOAD_PROGRESS_INTERVAL', 5),
+    )
     resonite_subtitles_file_supported: list = ['subrip']
     resonite_converted_subtitles_file_supported: list = ['ass', 'mov_text']
     resonite_extracted_subtitles_file_supported: list = ['PGSSUB']
 
     @staticmethod
-    def subtitles(item_id: str) -> str:
-        try:
-            data: dict = client.jellyfin.get_play_info(
+    def media_source(item_id: str) -> dict:
+        """Return the first media source of an item from its PlaybackInfo.
+
+        The PlaybackInfo is the heaviest call made to Jellyfin and every
+        subtitle endpoint needs it, so it is cached per item.
+        """
+        return play_info_cache.get_or_set(
+            item_id,
+            lambda: client.jellyfin.get_play_info(
                 item_id=item_id,
                 profile=Subtitle.profile
-            )
+            )['MediaSources'][0],
+        )
+
+    @staticmethod
+    def subtitles(item_id: str) -> str:
+        try:
+            source: dict = Subtitle.media_source(item_id)
         except jellyfin_apiclient_python_HTTPException:
             return "Item not existing on Jellyfin", 404
 
         subtitles: list = []
 
-        name: str = data['MediaSources'][0]['Path'].split('/')[-1]
+        name: str = source['Path'].split('/')[-1]
 
-        for media in data['MediaSources'][0]['MediaStreams']:
+        for media in source['MediaStreams']:
             if media['Type'] == 'Subtitle':
                 format_supported: bool = False
                 codec: str = media["Codec"]
@@ -99,80 +114,195 @@ class Subtitle:
 
         return ",".join(subtitles)
 
-    def download(item_id: str, name: str) -> (str, int):
-        data: str = client.jellyfin.download_url(item_id)
-        response: HTTPResponse = urlopen(data)
-        tt_size: int = int(response.headers["Content-Length"])
-        if name.is_file() and name.stat().st_size == tt_size:
-            logging.warning('File already exist and seems to be the same, ignoring dl...')
-        else:
-            hz_tt_size: str = sizeof_fmt(tt_size)
-            size = 0
-            with open(name, 'wb') as dest_file:
-                for dat in iter(partial(response.read, 32768), b''):
-                    dest_file.write(dat)
-                    size += len(dat)
-                    logging.info(f"{sizeof_fmt(size)} / {hz_tt_size}")
-        return name, tt_size
+    @staticmethod
+    def download(
+        item_id: str,
+        name: Path,
+        stop: Optional[Event] = None,
+        progress: Optional[Callable[[int, int, float], None]] = None,
+    ) -> (Path, int):
+        url: str = client.jellyfin.download_url(item_id)
+        return name, Subtitle.downloader.download(url, name, stop, progress)
+
+    @staticmethod
+    def download_track(
+        item_id: str,
+        stream_index: int,
+        name: Path,
+        stop: Optional[Event] = None,
+        progress: Optional[Callable[[int, int, float], None]] = None,
+    ) -> (Path, int):
+        """Copy a single subtitle track of a media in a `.sup` file.
+
+        ffmpeg reads the media from Jellyfin and only writes the packets of
+        the selected track, so the disk usage is the size of the subtitles
+        and not of the media. The track is written in a `.part` file renamed
+        once complete.
+
+        :param progress: Called as by :py:meth:`Downloader.download`, the
+            bytes done being estimated from the position of ffmpeg in the media.
+        """
+        url: str = client.jellyfin.download_url(item_id)
+        part: Path = name.with_name(name.name + '.part')
+        source: dict = Subtitle.media_source(item_id)
+        # The errors go in a file and not a pipe, which would block ffmpeg
+        # once full as it is only read when ffmpeg exits.
+        with tempfile.TemporaryFile() as errors:
+            process: subprocess.Popen = subprocess.Popen(
+                [
+                    'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+                    '-progress', 'pipe:1', '-nostats',
+                    '-i', url,
+                    '-map', f'0:{stream_index}', '-c', 'copy', '-f', 'sup',
+                    str(part),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=errors,
+            )
+            # The progress is read until ffmpeg exits, so the pipe never fills.
+            # RunTimeTicks is in ticks of 100 ns.
+            reader: Thread = Thread(
+                target=Subtitle.track_progress,
+                args=(
+                    name.name, process.stdout, progress,
+                    source.get('Size') or 0, (source.get('RunTimeTicks') or 0) // 10,
+                ),
+                daemon=True,
+            )
+            reader.start()
+            while process.poll() is None:
+                if stop is not None and stop.wait(1):
+                    process.terminate()
+                    process.wait()
+                    raise DownloadInterrupted(f"Extraction of the track {stream_index} of {item_id} interrupted")
+                if stop is None:
+                    process.wait()
+            reader.join()
+            if process.returncode != 0:
+                errors.seek(0)
+                raise RuntimeError(errors.read().decode('utf-8', 'replace').strip())
+        os.replace(part, name)
+        return name, name.stat().st_size
+
+    @staticmethod
+    def track_progress(
+        name: str,
+        output: IO[bytes],
+        progress: Optional[Callable[[int, int, float], None]],
+        size: int,
+        duration: int,
+    ) -> None:
+        """Report the progress written by ffmpeg with `-progress`.
+
+        The bytes of the media read are estimated as the part of `size` before
+        the position of ffmpeg, `out_time_us`, in a media of `duration`
+        microseconds. The reports are sent at most every `DOWNLOAD_PROGRESS_INTERVAL`.
+        """
+        reported_at: float = monotonic()
+        reported_done: int = 0
+        done: int = 0
+        hz_total: str = sizeof_fmt(size)
+        with output:
+            for line in output:
+                key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+                if key == 'out_time_us' and value.isdigit() and duration:
+                    done = min(size, size * int(value) // duration)
+                elif key == 'progress':
+                    now: float = monotonic()
+                    elapsed: float = now - reported_at
+                    if elapsed < Subtitle.downloader.progress_interval and value != 'end':
+                        continue
+                    if value == 'end':
+                        done = size
+                    speed: float = (done - reported_done) / elapsed if elapsed else 0
+                    reported_at, reported_done = now, done
+                    logging.info(f"{name}: {sizeof_fmt(done)} / {hz_total} ({sizeof_fmt(speed)}/s)")
+                    if progress is not None:
+                        progress(done, size, speed)
 
     @staticmethod
     def clean_sub(sub_file):
-        logging.info('Starting cleaning sub...')
-        sub = cleanitSubtitle(sub_file)
-        cfg = cleanitConfig()
-        rules = cfg.select_rules(tags={'no-style', 'ocr', 'tidy', 'no-spam'})
-        from cleanit.cli import clean_subtitle
-        clean_subtitle(
-            sub = sub,
-            rules = rules,
-            encoding = 'utf-8',
-            force = False,
-            test = False,
-            verbose = 99
-        )
+        subtitle_cleaner.clean(Path(sub_file))
+
+    @staticmethod
+    def publish(src: Path, final_filename: Path, item_id: str) -> Path:
+        """Move a finished subtitle in the output folder and index it."""
+        destination: Path = Subtitle.subtitles_output_folder / final_filename
+        os.replace(src, destination)
+        subtitle_store.add(destination, item_id)
+        return destination
 
     @staticmethod
     def subtitle(item_id, subtitle_name):
         try:
-            data = client.jellyfin.get_play_info(
-                item_id=item_id,
-                profile=Subtitle.profile
-            )
+            source = Subtitle.media_source(item_id)
         except jellyfin_apiclient_python_HTTPException:
             return "Item not existing on Jellyfin", 404
 
-        name = Path(data['MediaSources'][0]['Path'].split('/')[-1])
+        name = Path(source['Path'].split('/')[-1])
         subtitle_filename = f"{name.stem} - {subtitle_name}.srt"
 
-        subtitle_found = False
-        for entry in Path(Subtitle.subtitles_output_folder).iterdir():
-            if entry.is_file() and entry.suffix == '.srt' and entry.name == subtitle_filename:
-                subtitle_found = True
-
-        if subtitle_found:
-            return f"{Subtitle.proxy_url / subtitle_filename}"
+        if subtitle_filename in subtitle_store:
+            return subtitle_url(Subtitle.proxy_url, subtitle_filename)
         return "Subtitle not found", 404
 
     @staticmethod
-    def subtitle_extract(item_id, subtitle_name):
+    def convert(task: ExtractObject) -> None:
+        """Download a text subtitle from Jellyfin and convert it in srt.
+
+        The subtitle is converted while it is downloaded, the ASS/SSA files
+        with :py:func:`jellyfin2txt.ass.convert` and the others, already
+        delivered in srt by Jellyfin, copied as is. The subtitle is read in
+        UTF-8, or in the encoding of its BOM, see :py:func:`jellyfin2txt.utils.open_text`.
+
+        Run by the conversion workers of the extraction scheduler.
+
+        :raises ValueError: When the subtitle is not in UTF-8 and has no BOM.
+        """
+        tmp_filename = Subtitle.tmp_subtitles_output_folder / task.srt_name
+        digest = hashlib.sha256()
         try:
-            data = client.jellyfin.get_play_info(
-                item_id=item_id,
-                profile=Subtitle.profile
-            )
+            with urllib.request.urlopen(task.url) as response, open(tmp_filename, 'w', encoding='utf-8') as output:
+                lines = open_text(response, digest)
+                first = next((line for line in lines if line.strip()), '')
+                if first.lstrip().startswith('['):
+                    ass.convert(chain([first], lines), output, app.config.get('ASS_REORDER_WINDOW', 512))
+                else:
+                    output.write(first)
+                    output.writelines(lines)
+        except UnicodeDecodeError as err:
+            os.remove(tmp_filename)
+            raise ValueError(f"The subtitle is not in UTF-8 and has no BOM giving its encoding: {err}") from err
+        file_key = subtitle_store.digest_key(digest)
+        cached = subtitle_store.lookup_content(file_key)
+        if cached is not None:
+            # The same subtitle was already converted for another stream.
+            os.remove(tmp_filename)
+            subtitle_store.alias(cached, task.srt_name.name, task.item_id)
+            subtitle_store.add_content([task.content_key], cached)
+            return
+        if task.codec == 'mov_text':
+            Subtitle.clean_sub(tmp_filename)
+        Subtitle.publish(tmp_filename, task.srt_name, task.item_id)
+        subtitle_store.add_content([task.content_key, file_key], task.srt_name.name)
+
+    @staticmethod
+    def subtitle_extract(item_id, subtitle_name, owner=None):
+        try:
+            source = Subtitle.media_source(item_id)
         except jellyfin_apiclient_python_HTTPException:
             return "Item not existing on Jellyfin", 404
 
-        name = Path(data['MediaSources'][0]['Path'].split('/')[-1])
+        name = Path(source['Path'].split('/')[-1])
 
         subtitle_name_name = False
-        for media in data['MediaSources'][0]['MediaStreams']:
+        for media in source['MediaStreams']:
             if media['DisplayTitle'] == subtitle_name:
                     subtitle_name_name = True
         if not subtitle_name_name:
             return f"Subtitle {subtitle_name} not found for this media", 404
 
-        for media in data['MediaSources'][0]['MediaStreams']:
+        for media in source['MediaStreams']:
             format_supported = False
             if media['Type'] == 'Subtitle':
                 if media['DisplayTitle'] != subtitle_name:
@@ -180,90 +310,118 @@ class Subtitle:
                 codec = media["Codec"]
 
                 final_filename = Path(f"{name.stem} - {media['DisplayTitle']}.srt")
-                task_uuid = str(uuid.uuid4())
-                to_extract = False
+                stream_key = subtitle_store.stream_key(source, media['Index'])
+                url = None
                 if media['IsExternal'] or media['IsTextSubtitleStream'] or media['SupportsExternalStream']:
                     if 'DeliveryUrl' in media:
                         url = f"{app.config['SERVER_URL'].rstrip('/')}{media['DeliveryUrl']}"
                     else:
                         url = f"{app.config['SERVER_URL'].rstrip('/')}/Videos/{item_id}/{item_id}/Subtitles/{media['Index']}/0/Stream.{codec}"
-                    tmp_filename = Subtitle.tmp_subtitles_output_folder / final_filename 
-                    if codec in Subtitle.resonite_subtitles_file_supported:
-                        urllib.request.urlretrieve(url, tmp_filename)
-                        os.replace(tmp_filename, f"{Subtitle.subtitles_output_folder/final_filename}")
-                    if codec in Subtitle.resonite_converted_subtitles_file_supported:
-                        if codec == 'ass':
-                            urllib.request.urlretrieve(url, tmp_filename)
-                            sub = pyasstosrtSubtitle(tmp_filename)
-                            sub.export(output_dir=Subtitle.tmp_subtitles_output_folder)
-                            os.replace(tmp_filename, f"{Subtitle.subtitles_output_folder/final_filename}")
-                        elif codec == 'mov_text':
-                            urllib.request.urlretrieve(url, tmp_filename)
-                            Subtitle.clean_sub(tmp_filename)
-                            os.replace(tmp_filename, f"{Subtitle.subtitles_output_folder/final_filename}")
-                        else:
-                            format_supported = False
-                    format_supported = True
+                    if (
+                        codec in Subtitle.resonite_subtitles_file_supported
+                        or codec in Subtitle.resonite_converted_subtitles_file_supported
+                    ):
+                        kind = 'convert'
+                        format_supported = True
                 elif  media['Codec'] in Subtitle.resonite_extracted_subtitles_file_supported:
-                    srt_file = Subtitle.subtitles_output_folder / final_filename
-                    if srt_file.is_file():
+                    if final_filename.name in subtitle_store:
                         return "Subtitle already extracted"
-                    if final_filename in extract_tasks:
-                        return f"Subtile extraction {extract_tasks.item(final_filename).status}"
-                    to_extract = True
+                    kind = 'ocr'
                     format_supported = True
-                else:
-                    format_supported = False
 
                 if format_supported:
-                    extract_tasks[task_uuid] = ExtractObject(
+                    # A subtitle already made from the same stream is reused
+                    # instead of converted or OCR'd again.
+                    cached = subtitle_store.lookup_content(stream_key)
+                    if cached is not None:
+                        subtitle_store.alias(cached, final_filename.name, item_id)
+                        return "Subtitle extracted correctly"
+                    # Concurrent requests for the same subtitle share the same job.
+                    task_uuid, created = extract_tasks.submit(ExtractObject(
                         srt_name = final_filename,
-                        status = 'planned' if to_extract else 'done',
+                        status = 'planned',
                         item_id = item_id,
-                        item_name = name
-                    )
-                    if not to_extract:
-                        return "Subtitle extracted correctly"
-                    else:
-                        extract_queue.put(task_uuid)
-                        return "Subtitle extraction started"
+                        item_name = name,
+                        stream_index = media['Index'],
+                        language = media.get('Language') or '',
+                        content_key = stream_key,
+                        kind = kind,
+                        url = url,
+                        codec = codec,
+                        owner = owner,
+                    ))
+                    if not created:
+                        return (
+                            f"Subtile extraction {extract_tasks[task_uuid].status}",
+                            200,
+                            {'X-Job-Id': task_uuid},
+                        )
+                    extract_queue.put(task_uuid)
+                    return "Subtitle extraction started", 200, {'X-Job-Id': task_uuid}
                 else:
                     logging.warning(f"Format {media['DisplayTitle']} {codec} not suported for item id {item_id}")
                     if media['IsExternal'] or media['IsTextSubtitleStream'] or media['SupportsExternalStream']:
                         logging.info('This format seems to be easly convertable in srt')
-        if not data['MediaSources'][0]['MediaStreams']:
+        if not source['MediaStreams']:
             logging.warning('No subtitle found')
 
         return "Error while returning the srt", 500
 
     @staticmethod
-    def subtitle_discover(item_id):
+    def discover(task: ExtractObject) -> None:
+        """Search the providers for the subtitles of a media and publish them.
+
+        Run by the discovery workers of the extraction scheduler.
+        """
+        name = Path(task.item_name)
+        found = subtitle_discoverer.discover(name.name, Subtitle.subs_providers_langs)
+        for language, text in found.items():
+            final_filename = Path(f"{name.stem}.{language.alpha3}.srt")
+            if final_filename.name in subtitle_store:
+                continue
+            entry = Subtitle.tmp_subtitles_output_folder / final_filename
+            entry.write_text(text, encoding='utf-8')
+            Subtitle.clean_sub(entry)
+            Subtitle.publish(entry, final_filename, task.item_id)
+        if not found:
+            raise LookupError(f"No subtitle found for {name.name}")
+
+    @staticmethod
+    def subtitle_discover(item_id, owner=None):
         try:
-            data = client.jellyfin.get_play_info(
-                item_id=item_id,
-                profile=Subtitle.profile
-            )
+            source = Subtitle.media_source(item_id)
         except jellyfin_apiclient_python_HTTPException:
             return "Item not existing on Jellyfin", 404
 
-        name = Path(data['MediaSources'][0]['Path'].split('/')[-1])
-        video = Video.fromname(name)
-
-        best_subtitles = download_best_subtitles(
-            videos=[video],
-            languages=Subtitle.subs_providers_langs,
-            provider_configs=Subtitle.subs_providers_config
-        )
+        name = Path(source['Path'].split('/')[-1])
 
         subs = []
-        for best_subtitle in best_subtitles[video]:
-            sub = save_subtitles(video, [best_subtitle], directory='tmp')
-            sub_name = sub[0].get_path(video)
-            entry = Path("tmp") / Path(sub_name)
-            Subtitle.clean_sub(entry)
-            final_filename = f"{str(name.stem)}.{sub[0].language.alpha3}.srt"
-            os.replace(entry, f"{Subtitle.subtitles_output_folder/final_filename}")
-            subs.append(f"{sub[0].language},{Subtitle.subtitles_output_folder/final_filename}")
+        pending = False
+        for language in Subtitle.subs_providers_langs:
+            final_filename = f"{str(name.stem)}.{language.alpha3}.srt"
+            if final_filename in subtitle_store:
+                subs.append(f"{language},{Subtitle.subtitles_output_folder/final_filename}")
+            elif not subtitle_discoverer.searched(name.name, language):
+                pending = True
+
+        if pending:
+            discover_name = Path(f"{name.stem}.discover")
+            # Concurrent requests for the same media share the same job.
+            task_uuid, created = extract_tasks.submit(ExtractObject(
+                srt_name = discover_name,
+                status = 'planned',
+                item_id = item_id,
+                item_name = name,
+                kind = 'discover',
+                owner = owner,
+            ))
+            if created:
+                extract_queue.put(task_uuid)
+            return (
+                f"Subtitle discovery {extract_tasks[task_uuid].status}",
+                200,
+                {'X-Job-Id': task_uuid},
+            )
 
         if subs:
             return ";".join(subs)
@@ -273,83 +431,71 @@ class Subtitle:
     @staticmethod
     def subtitles_all(item_id):
         try:
-            data = client.jellyfin.get_play_info(
-                item_id=item_id,
-                profile=Subtitle.profile
-            )
+            source = Subtitle.media_source(item_id)
         except jellyfin_apiclient_python_HTTPException:
             return "Item not existing on Jellyfin", 404
         response = ''
 
-        name = Path(data['MediaSources'][0]['Path'].split('/')[-1])
+        name = Path(source['Path'].split('/')[-1])
 
-        for file in Subtitle.subtitles_output_folder.iterdir():
-            gfile = guessit(file)
-            gitem = guessit(Subtitle.subtitles_output_folder / name)
-            if file.is_file():
-                if gfile['title'] == gitem['title']:
-                    if 'year' not in gfile or 'year' not in gitem:
-                        logging.warning(f"The file '{file}' doesn't have enough information for match with '{name}'")
-                    else:
-                        try:
-                            lang = gfile['subtitle_language'].name
-                        except AttributeError:
-                            lang = gfile['subtitle_language']
-                        variables = [lang, file.name, f"{Subtitle.proxy_url}/{file}"]
-                        response += ','.join(variables) + ';'
+        for file_name, lang in subtitle_store.match(name.name):
+            file = Subtitle.subtitles_output_folder / file_name
+            variables = [lang, file.name, subtitle_url(Subtitle.proxy_url, file.name)]
+            response += ','.join(variables) + ';'
 
         return response
 
     @staticmethod
-    def subtitle_extract_thread():
-        import time
-        while True:
-            if extract_queue.empty():
-                time.sleep(2)
-                continue
-            task_uuid = extract_queue.get()
-            item = extract_tasks[task_uuid]
-            item_id = item.item_id
-            name = item.item_name
-            final_filename = item.srt_name
-            extract_tasks[task_uuid].update("status", "in progress")
-            try:
-                from sh import mkvmerge
-            except ImportError:
-                msg = "Cannot extract subtitles if mkvmerge is not available."
-                extract_tasks[task_uuid].update("status", "error")
-                extract_tasks[task_uuid].update("error_message", msg)
-                logging.error(msg)
-                continue
-            media_dl_path = Path(Subtitle.tmp_subtitles_output_folder) / Path(name)
-            sub_temp_file, sub_temp_file_size = Subtitle.download(item_id, media_dl_path)
-            free_mem = psutil.virtual_memory().available
-            if sub_temp_file_size >= free_mem + 100000:
-                msg = f'Only {sizeof_fmt(free_mem)} RAM free while the file is {sizeof_fmt(sub_temp_file_size)}'
-                extract_tasks[task_uuid].update("status", "error")
-                extract_tasks[task_uuid].update("error_message", msg)
-                logging.error(msg)
-                continue
-
-            media = Mkv(sub_temp_file)
-            options = Options(languages={Language('eng')}, overwrite=True, one_per_lang=False)
-            logging.info("Processing the media...")
-            pgsrip.rip(media, options)
-
-            for entry in Path(Subtitle.tmp_subtitles_output_folder).iterdir():
-                if entry.is_file() and entry.suffix == '.srt':
-                    Subtitle.clean_sub(entry)
-                    os.replace(entry, f"{Subtitle.subtitles_output_folder/final_filename}")
+    def subtitle_extract_status(item_id, subtitle_name, since=None, wait=0):
+        tasks = extract_tasks.tasks(item_id)
+        if not tasks:
+            return ""
+        task_uuid, task = tasks[-1]
+        for task_uuid, task in reversed(tasks):
+            if task.srt_name.name.endswith(f" - {subtitle_name}.srt"):
+                break
+        return Subtitle.job_status(task_uuid, since, wait)
 
-            logging.info("Cleaning downloaded file...")
-            os.remove(media_dl_path)
-            extract_tasks[task_uuid].update("status", "done")
+    @staticmethod
+    def job_status(task_uuid, since=None, wait=0):
+        if extract_tasks.get(task_uuid) is None:
+            return "Job not found", 404
+        _, last_update = extract_tasks.wait(since, wait if since is not None else 0, {task_uuid})
+        task = extract_tasks.get(task_uuid)
+        if task is None:
+            return "Job not found", 404
+        return str(task), 200, {'X-Since': str(last_update)}
 
     @staticmethod
-    def subtitle_extract_status(item_id, subtitle_name):
-        item = extract_tasks.item(item_id)
-        return str(item) if item else ""
+    def extract_status(since=None, wait=0):
+        changes, last_update = extract_tasks.wait(since, wait if since is not None else 0)
+        return ";".join([f"{k},{v}" for k,v in changes]), 200, {'X-Since': str(last_update)}
 
     @staticmethod
-    def extract_status():
-        return ";".join([f"{k},{v}" for k,v in extract_tasks.items()])
\ No newline at end of file
+    def extract_events(since=None):
+        """Yield the changes of the extraction tasks as Server-Sent Events.
+
+        The id of an event is the `updated_at` of the task, a comment is
+        sent when nothing changed for `keepalive` seconds.
+
+        Each stream holds a server thread, so it ends after
+        `EXTRACT_EVENTS_MAX_DURATION` seconds with the id of the last change
+        seen, and the client reconnects from it.
+        """
+        keepalive = app.config.get('EXTRACT_EVENTS_KEEPALIVE', 15)
+        deadline = monotonic() + app.config.get('EXTRACT_EVENTS_MAX_DURATION', 300)
+        if since is None:
+            since = extract_tasks.latest()
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                # An event without data only sets the id the client reconnects from.
+                yield f"id: {since}\n\n"
+                return
+            changes, last_update = extract_tasks.wait(since, min(keepalive, remaining))
+            if not changes:
+                yield ": keep-alive\n\n"
+                continue
+            for k,v in changes:
+                yield f"id: {v.updated_at}\ndata: {k},{v}\n\n"
+            since = last_update
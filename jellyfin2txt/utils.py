@@ -1,20 +1,46 @@
+import io
 import os
 import json
-import uuid
-from pathlib import PosixPath
-from time import time
+import codecs
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path, PurePath
+from threading import Condition, RLock
+from time import monotonic, time
+from typing import BinaryIO, Callable, Optional, TextIO
+from uuid import uuid4
 
 from jellyfin2txt.key import Key, KeysValidator
 
+_keyfile_cache: dict = {'stat': None, 'keys': KeysValidator()}
+
 def _read_keyfile() -> KeysValidator:
-    keys_json = {}
+    """Return the keys of `keyfile.json`.
+
+    The file is only parsed again when its inode, size or modification time
+    changed, so a `key.py revokekey` is picked up on the next request while
+    the other requests cost a single `stat` call.
+    """
     keyfile = 'keyfile.json'
-    if os.path.isfile(keyfile):
-        with open(keyfile, 'r') as file:
-            keys_json = json.load(file)
+    try:
+        stat = os.stat(keyfile)
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        signature = None
+    if signature == _keyfile_cache['stat']:
+        return _keyfile_cache['keys']
+    keys_json = {}
+    if signature is not None:
+        try:
+            with open(keyfile, 'r') as file:
+                keys_json = json.load(file)
+        except json.decoder.JSONDecodeError:
+            return _keyfile_cache['keys']
     keys = KeysValidator()
     for key in keys_json:
         keys.append(Key(**key), 'id')
+    _keyfile_cache['stat'], _keyfile_cache['keys'] = signature, keys
     return keys
 
 def sizeof_fmt(num: int, suffix: str = "B") -> str:
@@ -37,54 +63,314 @@ def sizeof_fmt(num: int, suffix: str = "B") -> str:
         num /= 1024.0
     return f"{num:.1f}Yi{suffix}"
 
+def process_pool(workers: int, initializer: Optional[Callable] = None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """Return a pool of `workers` processes.
+
+    The processes are forked so they never import the main module again,
+    which would login to Jellyfin in each of them.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context('fork'),
+        initializer=initializer, initargs=initargs,
+    )
+
+def subtitle_url(proxy_url: str, file_name: str) -> str:
+    """Return the url of the subtitle `file_name` served under `proxy_url`."""
+    return f"{proxy_url.rstrip('/')}/{PurePath(file_name).name}"
+
+# The BOMs of the text encodings, the UTF-32 ones first as they start as the UTF-16 ones.
+TEXT_BOMS: tuple = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+class HashingReader(io.RawIOBase):
+    """Read a binary stream, updating `digest` with the bytes read."""
+
+    def __init__(self, stream: BinaryIO, digest) -> None:
+        super().__init__()
+        self.stream: BinaryIO = stream
+        self.digest = digest
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data: bytes = self.stream.read(len(buffer))
+        self.digest.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+def open_text(stream: BinaryIO, digest) -> TextIO:
+    """Return the text of a binary stream, hashing its bytes in `digest` as it is read.
+
+    The text is decoded as UTF-8 unless it starts with a BOM, the lines keep
+    their line endings. Reading the text raises a `UnicodeDecodeError` when
+    it is not in the encoding found, instead of replacing the characters.
+    """
+    reader: io.BufferedReader = io.BufferedReader(HashingReader(stream, digest))
+    head: bytes = reader.peek(4)[:4]
+    encoding: str = next((name for bom, name in TEXT_BOMS if head.startswith(bom)), 'utf-8')
+    return io.TextIOWrapper(reader, encoding=encoding, errors='strict', newline='')
+
+class DownloadInterrupted(Exception):
+    pass
+
+
 class ExtractTasks(dict):
+    """The extraction tasks by uuid, indexed by srt name and item id.
+
+    The finished tasks, done, in error or interrupted, are kept for
+    `retention` seconds and at most `max_finished` of them, the oldest are
+    evicted when a new task is added.
+
+    The tasks are written through to `store` when given, see :py:meth:`load`.
+
+    Each change of a task sets its `updated_at` to a time in milliseconds
+    greater than any other `updated_at`, so the clients can ask for the
+    changes since the last one they saw, see :py:meth:`wait`.
+
+    :param retention: The time in seconds a finished task is kept.
+    :param max_finished: The maximum number of finished tasks kept.
+    :param store: The :py:class:`jellyfin2txt.jobs.JobStore` persisting the tasks.
+    """
+
+    finished_status: tuple = ('done', 'error', 'interrupted')
+    persisted_fields: tuple = ('status', 'error_message', 'checkpoint')
+
+    def __init__(self, retention: int = 3600, max_finished: int = 1000, store = None) -> None:
+        super().__init__()
+        self.store = store
+        self.retention: int = retention
+        self.max_finished: int = max_finished
+        self._by_srt_name: dict = {}
+        self._by_item: dict = {}
+        self._finished: OrderedDict = OrderedDict()
+        self._lock: RLock = RLock()
+        self._changed: Condition = Condition(self._lock)
+        self.last_update: int = 0
+
+    def __setitem__(self, task_uuid, task):
+        self._add(task_uuid, task)
+        if self.store is not None:
+            self.store.save(task_uuid, task)
+
+    def _stamp(self, task) -> None:
+        self.last_update = max(int(time() * 1000), self.last_update + 1)
+        task.updated_at = self.last_update
+        self._changed.notify_all()
+
+    def _add(self, task_uuid, task, stamp = True):
+        with self._lock:
+            if stamp:
+                self._stamp(task)
+            else:
+                self.last_update = max(self.last_update, task.updated_at or task.created_at)
+            self._evict()
+            if task_uuid in self.keys():
+                self._unindex(task_uuid)
+            super().__setitem__(task_uuid, task)
+            self._by_srt_name[task.srt_name] = task_uuid
+            self._by_item.setdefault(task.item_id, []).append(task_uuid)
+            task.on_update = lambda field, value: self._updated(task_uuid, field, value)
+            if task.status in self.finished_status:
+                self._finished[task_uuid] = (task.updated_at or task.created_at) / 1000
+
+    def __delitem__(self, task_uuid):
+        with self._lock:
+            self._unindex(task_uuid)
+            super().__delitem__(task_uuid)
+        if self.store is not None:
+            self.store.delete(task_uuid)
+
     def __contains__(self, srt_name):
-        for k,v in self.items():
-            if v.srt_name == srt_name:
-                return True
-        return False
-    def is_uuid(self, item):
-        try:
-            return uuid.UUID(str(item))
-        except ValueError:
-            return False
-    def item(self, item):
-        if self.is_uuid(item):
-            items = [x for x in self.values() if x.item_id == item]
-        else:
-            items = [x for x in self.values() if x.srt_name == item]
-        if items:
-            return items[0]
-        return False
+        return srt_name in self._by_srt_name
+
+    def _unindex(self, task_uuid) -> None:
+        task = self[task_uuid]
+        task.on_update = None
+        if self._by_srt_name.get(task.srt_name) == task_uuid:
+            del self._by_srt_name[task.srt_name]
+        uuids = self._by_item.get(task.item_id, [])
+        if task_uuid in uuids:
+            uuids.remove(task_uuid)
+            if not uuids:
+                del self._by_item[task.item_id]
+        self._finished.pop(task_uuid, None)
+
+    def _updated(self, task_uuid, field, value) -> None:
+        with self._lock:
+            task = self.get(task_uuid)
+            if task is None:
+                return
+            self._stamp(task)
+            if field == 'status':
+                if value in self.finished_status:
+                    self._finished[task_uuid] = time()
+                    self._finished.move_to_end(task_uuid)
+                else:
+                    self._finished.pop(task_uuid, None)
+        if self.store is not None and field in self.persisted_fields:
+            task = self.get(task_uuid)
+            if task is not None:
+                self.store.save(task_uuid, task)
+
+    def load(self):
+        """Load the tasks of the store and return the uuids of the ones to resume.
+
+        The tasks planned, in progress or interrupted when the server stopped
+        are planned again, in the order they were requested.
+        """
+        if self.store is None:
+            return []
+        pending = []
+        for task_uuid, task in self.store.load():
+            resumed = task.status in ('planned', 'in progress', 'interrupted')
+            if resumed:
+                task.status = 'planned'
+                pending.append(task_uuid)
+            self._add(task_uuid, task, stamp=resumed)
+        for task_uuid in pending:
+            self.store.save(task_uuid, self[task_uuid])
+        return pending
+
+    def _evict(self) -> None:
+        expire_at = time() - self.retention
+        while self._finished:
+            task_uuid, finished_at = next(iter(self._finished.items()))
+            if finished_at > expire_at and len(self._finished) <= self.max_finished:
+                return
+            del self[task_uuid]
+
+    def tasks(self, item_id):
+        """Return the `(uuid, task)` of an item id, the latest last."""
+        with self._lock:
+            return [(x, self[x]) for x in self._by_item.get(item_id, [])]
+
+    def wait(self, since = None, timeout = 0, uuids = None):
+        """Return the `(uuid, task)` changed since `since` and the last update.
+
+        Block until a task changed or for `timeout` seconds. The last update
+        is the value of `since` to use to get the next changes.
+
+        :param since: The `updated_at` of the last change known, every task when None.
+        :param timeout: The maximum time in seconds to wait for a change.
+        :param uuids: Only look for the changes of these tasks.
+        """
+        deadline = monotonic() + timeout
+        with self._changed:
+            while True:
+                changes = sorted(
+                    (
+                        (k, v) for k, v in self.items()
+                        if (uuids is None or k in uuids)
+                        and (since is None or (v.updated_at or v.created_at) > since)
+                    ),
+                    key=lambda change: change[1].updated_at or change[1].created_at,
+                )
+                remaining = deadline - monotonic()
+                if changes or remaining <= 0:
+                    return changes, self.last_update
+                self._changed.wait(remaining)
+
+    def latest(self):
+        """Return the `updated_at` of the last change."""
+        return self.last_update
+
+    def running(self, srt_name):
+        """Return the uuid of the planned or in progress task making `srt_name`."""
+        with self._lock:
+            task_uuid = self._by_srt_name.get(srt_name)
+            if task_uuid is not None and self[task_uuid].status in ('planned', 'in progress'):
+                return task_uuid
+        return None
+
+    def submit(self, task):
+        """Add a task unless a task making the same srt name is running.
+
+        :returns: The uuid of the task running or added, and if the task was added.
+        """
+        with self._lock:
+            task_uuid = self.running(task.srt_name)
+            if task_uuid is not None:
+                return task_uuid, False
+            task_uuid = str(uuid4())
+            self[task_uuid] = task
+            return task_uuid, True
 
 
 class ExtractObject:
+    __slots__ = (
+        'srt_name', 'status', 'item_id', 'item_name', 'error_message',
+        'stream_index', 'language', 'content_key', 'kind', 'url', 'codec',
+        'owner', 'downloaded', 'size', 'speed', 'created_at', 'updated_at',
+        'checkpoint', 'on_update',
+    )
 
-    def __init__(self, srt_name, status, item_id, item_name, error_message = ""):
+    def __init__(self, srt_name, status, item_id, item_name, error_message = "", stream_index = None, language = "", content_key = None, kind = "ocr", url = None, codec = None, owner = None):
         self.srt_name = srt_name
         self.status = status
         self.item_id = item_id
         self.item_name = item_name
         self.error_message = error_message
+        self.stream_index = stream_index
+        self.language = language
+        self.content_key = content_key
+        self.kind = kind
+        self.url = url
+        self.codec = codec
+        self.owner = owner
+        self.downloaded = 0
+        self.size = 0
+        self.speed = 0
         self.created_at = int(time() * 1000)
         self.updated_at = ""
+        self.checkpoint = None
+        self.on_update = None
+
+    @classmethod
+    def load(cls, data):
+        """Build a task from the fields returned by :py:meth:`dump`."""
+        task = cls(Path(data.pop('srt_name')), data.pop('status'), data.pop('item_id'), Path(data.pop('item_name')))
+        for k, v in data.items():
+            if k in cls.__slots__:
+                setattr(task, k, v)
+        return task
+
+    def dump(self):
+        dumped = {}
+        for k in self.__slots__:
+            if k == 'on_update':
+                continue
+            v = getattr(self, k)
+            dumped[k] = str(v) if isinstance(v, PurePath) else v
+        return dumped
+
+    def __reduce__(self):
+        # The callback of the registry is not sent to other processes.
+        return self.__class__.load, (self.dump(),)
 
     def update(self, field, value):
         setattr(self, field, value)
-        self.updated_at = int(time() * 1000)
+        if self.on_update is not None:
+            self.on_update(field, value)
+        else:
+            self.updated_at = int(time() * 1000)
+
+    def progress(self, downloaded, size, speed):
+        self.downloaded = downloaded
+        self.size = size
+        self.update('speed', int(speed))
 
     def __repr__(self):
-        return f"{self.srt_name},{self.status},{self.item_id},{self.item_name},{self.error_message},{self.created_at},{self.updated_at}"
+        return f"{self.srt_name},{self.status},{self.item_id},{self.item_name},{self.error_message},{self.created_at},{self.updated_at},{self.downloaded},{self.size},{self.speed}"
 
 
 class Jellyfin2TextSerializer(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ExtractObject):
-            serialized = {}
-            for k,v in obj.__dict__.items():
-                if isinstance(v, PosixPath):
-                    serialized[k] = str(v)
-                else:
-                    serialized[k] = v
-            return serialized
+            return obj.dump()
         return json.JSONEncoder.default(self, obj)
\ No newline at end of file
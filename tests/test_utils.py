@@ -0,0 +1,47 @@
+import io
+import codecs
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from jellyfin2txt.utils import open_text, subtitle_url
+
+
+def test_subtitle_url_joins_the_file_name():
+    assert subtitle_url('http://host/files', 'Movie - eng.srt') == 'http://host/files/Movie - eng.srt'
+
+
+def test_subtitle_url_of_an_output_path():
+    # A file of SUBTITLES_OUTPUT is served under its name only.
+    path: Path = Path('/data/subtitles') / 'Movie - eng.srt'
+    assert subtitle_url('http://host/files', path) == 'http://host/files/Movie - eng.srt'
+
+
+def test_subtitle_url_ignores_the_end_slash():
+    assert subtitle_url('http://host/files/', 'Movie - eng.srt') == 'http://host/files/Movie - eng.srt'
+
+
+def read_text(data: bytes) -> tuple:
+    digest = hashlib.sha256()
+    text: str = open_text(io.BytesIO(data), digest).read()
+    return text, digest.hexdigest()
+
+
+def test_open_text_reads_utf8_and_hashes_the_bytes():
+    data: bytes = '[Script Info]\r\nTitle: é\r\n'.encode('utf-8')
+    assert read_text(data) == ('[Script Info]\r\nTitle: é\r\n', hashlib.sha256(data).hexdigest())
+
+
+@pytest.mark.parametrize('encoding', ['utf-8-sig', 'utf-16', 'utf-16-be', 'utf-32'])
+def test_open_text_follows_the_bom(encoding):
+    text: str = '[Script Info]\nTitle: é\n'
+    data: bytes = text.encode(encoding)
+    if encoding == 'utf-16-be':
+        data = codecs.BOM_UTF16_BE + data
+    assert read_text(data)[0] == text
+
+
+def test_open_text_refuses_another_encoding():
+    with pytest.raises(UnicodeDecodeError):
+        read_text('[Script Info]\nTitle: é\n'.encode('cp1252'))